@@ -0,0 +1,27 @@
+"""Add metadata digest
+
+Revision ID: 2b7f9c4d8e13
+Revises: 9e4b1a6c2d58
+Create Date: 2026-10-18 18:02:47.561930
+
+"""
+from alembic import op
+from sqlalchemy import TEXT, Column
+
+# revision identifiers, used by Alembic.
+revision = '2b7f9c4d8e13'
+down_revision = '9e4b1a6c2d58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Existing fics have no digest, so they are saved in full on their next scrape, which fills it in.
+    op.add_column('fics', Column('metadata_digest', TEXT))
+
+    print(f"Upgrade to revision {revision} finished.")
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('fics') as batch_op:
+        batch_op.drop_column('metadata_digest')
@@ -0,0 +1,31 @@
+"""Add scrape scheduling columns
+
+Revision ID: 3f6b2d9e4a71
+Revises: ca2dfefaf0b6
+Create Date: 2026-10-18 09:12:40.318204
+
+"""
+from alembic import op
+from sqlalchemy import INTEGER, TEXT, Column
+
+# revision identifiers, used by Alembic.
+revision = '3f6b2d9e4a71'
+down_revision = 'ca2dfefaf0b6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Every existing fic starts with no history, so it is due on the next scrape.
+    op.add_column('fics', Column('last_checked', TEXT))
+    op.add_column('fics', Column('times_checked', INTEGER, server_default='0'))
+    op.add_column('fics', Column('times_changed', INTEGER, server_default='0'))
+
+    print(f"Upgrade to revision {revision} finished.")
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('fics') as batch_op:
+        batch_op.drop_column('times_changed')
+        batch_op.drop_column('times_checked')
+        batch_op.drop_column('last_checked')
@@ -0,0 +1,44 @@
+"""Add full-text search
+
+Revision ID: 4e8a1c7b3f25
+Revises: 6a3d8e5f1b92
+Create Date: 2026-10-18 19:20:36.774102
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '4e8a1c7b3f25'
+down_revision = '6a3d8e5f1b92'
+branch_labels = None
+depends_on = None
+
+# The columns indexed by this revision. They are listed here rather than read from constants, so the revision stays the same if that changes.
+COLUMNS = "title, summary, tags, characters, relationships"
+OLD_VALUES = "old.title, old.summary, old.tags, old.characters, old.relationships"
+NEW_VALUES = "new.title, new.summary, new.tags, new.characters, new.relationships"
+
+
+def upgrade() -> None:
+    # An external content FTS5 table only stores the index, and reads the text itself from fics.
+    # prefix also indexes the first 2 and 3 characters of every term, for prefix queries.
+    op.execute(f"CREATE VIRTUAL TABLE fics_fts USING fts5({COLUMNS}, content='fics', content_rowid='id', prefix='2 3')")
+    op.execute(f"CREATE TRIGGER fics_fts_insert AFTER INSERT ON fics BEGIN "
+               f"INSERT INTO fics_fts (rowid, {COLUMNS}) VALUES (new.id, {NEW_VALUES}); END")
+    op.execute(f"CREATE TRIGGER fics_fts_delete AFTER DELETE ON fics BEGIN "
+               f"INSERT INTO fics_fts (fics_fts, rowid, {COLUMNS}) VALUES ('delete', old.id, {OLD_VALUES}); END")
+    op.execute(f"CREATE TRIGGER fics_fts_update AFTER UPDATE OF {COLUMNS} ON fics BEGIN "
+               f"INSERT INTO fics_fts (fics_fts, rowid, {COLUMNS}) VALUES ('delete', old.id, {OLD_VALUES}); "
+               f"INSERT INTO fics_fts (rowid, {COLUMNS}) VALUES (new.id, {NEW_VALUES}); END")
+
+    # Index every fic that is already in the database
+    op.execute("INSERT INTO fics_fts (fics_fts) VALUES ('rebuild')")
+
+    print(f"Upgrade to revision {revision} finished.")
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER fics_fts_update")
+    op.execute("DROP TRIGGER fics_fts_delete")
+    op.execute("DROP TRIGGER fics_fts_insert")
+    op.execute("DROP TABLE fics_fts")
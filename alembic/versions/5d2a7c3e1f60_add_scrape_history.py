@@ -0,0 +1,32 @@
+"""Add scrape history
+
+Revision ID: 5d2a7c3e1f60
+Revises: 8c1e4f2a9b3d
+Create Date: 2026-10-18 14:02:51.771930
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '5d2a7c3e1f60'
+down_revision = '8c1e4f2a9b3d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # One row per scrape.
+    op.execute("CREATE TABLE runs (id INTEGER NOT NULL PRIMARY KEY, started DATETIME)")
+
+    # One row per fic that changed in a run. Columns that didn't change are NULL.
+    # The table is stored in (run_id, fic_id) order, so "what changed since run N" only reads the rows after run N.
+    op.execute("CREATE TABLE fic_history (run_id INTEGER NOT NULL, fic_id INTEGER NOT NULL, "
+               "kudos INTEGER, hits INTEGER, words INTEGER, nchapters INTEGER, status TEXT, "
+               "PRIMARY KEY (run_id, fic_id)) WITHOUT ROWID")
+
+    print(f"Upgrade to revision {revision} finished.")
+
+
+def downgrade() -> None:
+    op.drop_table('fic_history')
+    op.drop_table('runs')
@@ -0,0 +1,42 @@
+"""Add list filter indexes
+
+Revision ID: 6a3d8e5f1b92
+Revises: 2b7f9c4d8e13
+Create Date: 2026-10-18 18:41:13.208556
+
+"""
+from alembic import op
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision = '6a3d8e5f1b92'
+down_revision = '2b7f9c4d8e13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Indexes for --list --where status=... and --sort
+    op.execute("CREATE INDEX ix_fics_status ON fics (status COLLATE NOCASE)")
+    op.execute("CREATE INDEX ix_fics_kudos ON fics (kudos)")
+    op.execute("CREATE INDEX ix_fics_words ON fics (words)")
+
+    # One row for each of a fic's fandoms, for --list --where fandom=...
+    op.execute("CREATE TABLE fic_fandoms (fic_id INTEGER NOT NULL, fandom TEXT NOT NULL COLLATE NOCASE, "
+               "PRIMARY KEY (fic_id, fandom)) WITHOUT ROWID")
+    op.execute("CREATE INDEX ix_fic_fandoms_fandom ON fic_fandoms (fandom)")
+
+    connection = op.get_bind()
+    rows = connection.execute(text("SELECT id, fandoms FROM fics WHERE fandoms IS NOT NULL AND fandoms != ''"))
+    fandoms = [{'fic_id': fic_id, 'fandom': fandom} for fic_id, value in rows for fandom in value.split(", ") if fandom]
+    if fandoms:
+        connection.execute(text("INSERT OR IGNORE INTO fic_fandoms (fic_id, fandom) VALUES (:fic_id, :fandom)"), fandoms)
+
+    print(f"Upgrade to revision {revision} finished.")
+
+
+def downgrade() -> None:
+    op.drop_table('fic_fandoms')
+    op.drop_index('ix_fics_words', 'fics')
+    op.drop_index('ix_fics_kudos', 'fics')
+    op.drop_index('ix_fics_status', 'fics')
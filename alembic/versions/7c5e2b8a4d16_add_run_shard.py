@@ -0,0 +1,28 @@
+"""Add run shard
+
+Revision ID: 7c5e2b8a4d16
+Revises: 4e8a1c7b3f25
+Create Date: 2026-10-18 21:05:42.318846
+
+"""
+from alembic import op
+from sqlalchemy import TEXT, Column
+
+# revision identifiers, used by Alembic.
+revision = '7c5e2b8a4d16'
+down_revision = '4e8a1c7b3f25'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # The --shard (e.g. "1/4") a scrape was run with, so --shard 1/4 --resume only resumes that shard's scrape.
+    # Scrapes recorded before this revision weren't sharded.
+    op.add_column('runs', Column('shard', TEXT))
+
+    print(f"Upgrade to revision {revision} finished.")
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('runs') as batch_op:
+        batch_op.drop_column('shard')
@@ -0,0 +1,93 @@
+"""Typed columns, primary key and indexes
+
+Revision ID: 8c1e4f2a9b3d
+Revises: 3f6b2d9e4a71
+Create Date: 2026-10-18 11:47:05.602153
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '8c1e4f2a9b3d'
+down_revision = '3f6b2d9e4a71'
+branch_labels = None
+depends_on = None
+
+# The columns as they are at this revision, and their new types.
+COLUMNS = {
+    'date_edited': 'DATETIME',
+    'date_published': 'DATETIME',
+    'date_updated': 'DATETIME',
+    'bookmarks': 'INTEGER',
+    'categories': 'TEXT',
+    'nchapters': 'INTEGER',
+    'characters': 'TEXT',
+    'complete': 'BOOLEAN',
+    'comments': 'INTEGER',
+    'expected_chapters': 'INTEGER',
+    'fandoms': 'TEXT',
+    'hits': 'INTEGER',
+    'kudos': 'INTEGER',
+    'language': 'TEXT',
+    'rating': 'TEXT',
+    'relationships': 'TEXT',
+    'restricted': 'BOOLEAN',
+    'status': 'TEXT',
+    'summary': 'TEXT',
+    'tags': 'TEXT',
+    'title': 'TEXT',
+    'warnings': 'TEXT',
+    'words': 'INTEGER',
+    'collections': 'TEXT',
+    'authors': 'TEXT',
+    'series': 'TEXT',
+    'chapter_titles': 'TEXT',
+    'last_checked': 'DATETIME',
+}
+
+
+def convert_to(column, type_):
+    # Every value used to be stored with str(), so Python's None was stored as the string 'None'.
+    value = f"NULLIF({column}, 'None')"
+    if type_ == 'INTEGER':
+        return f"CAST({value} AS INTEGER)"
+    if type_ == 'BOOLEAN':
+        return f"CASE {value} WHEN 'True' THEN 1 WHEN 'False' THEN 0 END"
+    return value
+
+
+def convert_from(column, type_):
+    if type_ == 'INTEGER':
+        return f"CAST({column} AS TEXT)"
+    if type_ == 'BOOLEAN':
+        return f"CASE {column} WHEN 1 THEN 'True' WHEN 0 THEN 'False' END"
+    return column
+
+
+def rebuild_table(id_definition, types, convert):
+    # SQLite can't change the type of a column, so the table is copied into a new one with the new types.
+    definitions = ", ".join(f"{column} {types[column]}" for column in COLUMNS)
+    op.execute(f"CREATE TABLE fics_new ({id_definition}, {definitions}, times_checked INTEGER DEFAULT 0, times_changed INTEGER DEFAULT 0)")
+
+    names = ", ".join(COLUMNS)
+    values = ", ".join(convert(column, COLUMNS[column]) for column in COLUMNS)
+    # INSERT OR IGNORE drops any duplicate IDs, which the old table allowed.
+    op.execute(f"INSERT OR IGNORE INTO fics_new (id, {names}, times_checked, times_changed) "
+               f"SELECT CAST(id AS INTEGER), {values}, times_checked, times_changed FROM fics WHERE id IS NOT NULL")
+
+    op.execute("DROP TABLE fics")
+    op.execute("ALTER TABLE fics_new RENAME TO fics")
+
+
+def upgrade() -> None:
+    rebuild_table("id INTEGER NOT NULL PRIMARY KEY", COLUMNS, convert_to)
+
+    op.execute("CREATE INDEX ix_fics_date_updated ON fics (date_updated)")
+    op.execute("CREATE INDEX ix_fics_complete ON fics (complete)")
+
+    print(f"Upgrade to revision {revision} finished.")
+
+
+def downgrade() -> None:
+    # Dropping the table in rebuild_table also drops its indexes.
+    rebuild_table("id INTEGER", {column: 'TEXT' for column in COLUMNS}, convert_from)
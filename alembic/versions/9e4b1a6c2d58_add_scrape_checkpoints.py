@@ -0,0 +1,35 @@
+"""Add scrape checkpoints
+
+Revision ID: 9e4b1a6c2d58
+Revises: 5d2a7c3e1f60
+Create Date: 2026-10-18 17:25:09.402117
+
+"""
+from alembic import op
+from sqlalchemy import Column
+from sqlalchemy.dialects.sqlite import DATETIME
+
+# revision identifiers, used by Alembic.
+revision = '9e4b1a6c2d58'
+down_revision = '5d2a7c3e1f60'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('runs', Column('finished', DATETIME))
+
+    # Scrapes recorded before this revision always finished.
+    op.execute("UPDATE runs SET finished = started")
+
+    # The fics each unfinished scrape still has to check
+    op.execute("CREATE TABLE pending_fics (run_id INTEGER NOT NULL, fic_id INTEGER NOT NULL, "
+               "PRIMARY KEY (run_id, fic_id)) WITHOUT ROWID")
+
+    print(f"Upgrade to revision {revision} finished.")
+
+
+def downgrade() -> None:
+    op.drop_table('pending_fics')
+    with op.batch_alter_table('runs') as batch_op:
+        batch_op.drop_column('finished')
@@ -1,211 +1,526 @@
 # The main program for ao3scraper.
 
 # Core modules
-import AO3
 import click
 
-# Web scraping
-import requests
-from requests.exceptions import Timeout, ConnectionError
-from concurrent.futures import ThreadPoolExecutor
-
-# Formatting
-from rich.console import Console
-from rich.table import Table
-from rich.progress import Progress
-from rich.traceback import install
-install()
-
 # Other modules
-from datetime import datetime
-import copy
-import pickle
-import warnings
+import io
+import time
 
 # Custom modules
 import constants
-import database
 
-# Create columns of rich table
-table = Table(title="Fanfics", show_lines=True)
-table.add_column("Index")
+"""
+Everything else (AO3, requests, rich, the database and the config file) is loaded by the subcommand that needs it,
+so that --version and --help don't pay for importing them or reading the whole database.
+"""
+
+# Number of fics added to the database at a time by import_urls
+IMPORT_BATCH_SIZE = 1000
+
+# Number of scraped fics saved to the database at a time by scrape_urls
+CHECKPOINT_SIZE = 50
 
+# Filled in by read_database()
+fic_ids = []
+local_fics = []
+
+# Filled in by create_table()
+table = None
 args = []
-for i in constants.TABLE_TEMPLATE:
-    table.add_column(i["name"], style=i["styles"])
-    args.append(i["column"])
+formatters = None
 
-console = Console()
+WORK_LINK = "https://archiveofourown.org/works/"
 
-# Read database
-fic_ids = database.get_fic_ids()
-local_fics = database.get_all_fics()
+# The columns each custom column is made from
+CUSTOM_COLUMN_SOURCES = {'$chapters': ['nchapters', 'expected_chapters'], '$latest_chapter': ['chapter_titles']}
 
 # Start click command
 @click.command()
 @click.option('--scrape', '-s', is_flag=True, help='Launches scraping mode.')
+@click.option('--all', 'scrape_all', is_flag=True, help='Scrapes every entry, not just the ones due to be checked. (Use with --scrape)')
+@click.option('--resume', is_flag=True, help='Continues the last interrupted scrape. (Use with --scrape)')
+@click.option('--shard', help='Only scrapes shard I of N, so that N invocations can split a scrape. (Use with --scrape)', callback=lambda ctx, param, value: parse_shard(value), metavar='I/N')
 @click.option('--cache', '-c', is_flag=True, help='Prints the last scraped table.')
 @click.option('--list', '-l', is_flag=True, help='Lists all entries in the database.')
+@click.option('--search', help='Lists the entries whose title, summary, tags, characters or relationships match QUERY, best matches first.', metavar='QUERY')
+@click.option('--limit', help='Lists at most this many entries. (Use with --list or --search)', type=int)
+@click.option('--offset', default=0, help='Skips this many entries before listing. (Use with --list or --search)', type=int)
+@click.option('--pager', is_flag=True, help='Shows the list in a pager. (Use with --list or --search)')
+@click.option('--where', 'filters', multiple=True, callback=lambda ctx, param, value: parse_filters(value), metavar='FILTER',
+              help='Only lists fics matching FILTER: fandom=NAME (matches the start of a fandom), status=STATUS, complete=yes|no, '
+                   'stale=yes|no or updated-since=YYYY-MM-DD. Can be given more than once. (Use with --list or --search)')
+@click.option('--sort', type=click.Choice(['kudos', 'words', 'date_updated']), help='Lists fics by this column, highest or newest first. (Use with --list or --search)')
+@click.option('--format', 'output_format', type=click.Choice(['table', 'jsonl', 'csv']), default='table', help='Prints fics as a table, JSON Lines or CSV. (Use with --scrape, --cache, --list or --search)')
+@click.option('--changes', help='Shows what changed since scrape number N. (0 shows every change)', type=int, metavar='N')
 @click.option('--add', '-a', help='Adds a single url to the database.')
 @click.option('--add-urls', is_flag=True, help='Opens a text file to add multiple urls to the database.')
-@click.option('--delete', '-d', help='Deletes an entry from the database.', type=int)
+@click.option('--import', 'import_file', help='Adds every url in a file (one on each line) to the database. Use - to read from stdin.', type=click.File('r'), metavar='FILE')
+@click.option('--delete', '-d', help='Deletes an entry from the database, by its index in --list.', type=int)
+@click.option('--daemon', is_flag=True, help='Keeps running, checking each fic as soon as it is due.')
+@click.option('--daemon-command', help='Sends a command to the running daemon: status, add URL, delete ID or stop.', metavar='COMMAND')
+@click.option('--profile', is_flag=True, help='Profiles the command with cProfile and saves the stats.')
 @click.option('--version', '-v', is_flag=True, help='Display version of ao3scraper and other info.')
-def main(scrape, cache, list, add, add_urls, delete, version):
-    if scrape:
-        scrape_urls()
+def main(scrape, scrape_all, resume, shard, cache, list, search, limit, offset, pager, filters, sort, output_format, changes, add, add_urls, import_file, delete, daemon, daemon_command, profile, version):
+    if profile:
+        start_profiler()
+
+    if scrape or cache or list or search is not None or changes is not None or add or add_urls or import_file or delete or daemon:
+        from rich.traceback import install
+        install()
+
+    # --search lists fics like --list, limited to the ones matching the query.
+    if search is not None:
+        sort = search_order(search, sort)
+        list = True
+
+    if output_format != 'table' and (scrape or cache or list):
+        write_machine_output(output_format, scrape, scrape_all, shard, resume, cache, limit, offset, filters, sort, search)
+    elif scrape:
+        scrape_urls(scrape_all, shard, resume)
     elif cache:
         print_cached_table()
     elif list:
-        construct_rich_table(list)
+        construct_rich_table(limit, offset, pager, filters, sort, search)
+    elif changes is not None:
+        print_changes(changes)
     elif add:
         add_url_single(add)
     elif add_urls:
         add_url_multiple()
+    elif import_file:
+        import_urls(import_file)
     elif delete:
         delete_entry(delete)
+    elif daemon:
+        start_daemon()
+    elif daemon_command:
+        send_daemon_command(daemon_command)
     elif version:
+        from rich.console import Console
+
         print(
             f"Version: {constants.APP_VERSION}\n"
             f"Data location: {constants.DATA_PATH}\n"
             f"Config location: {constants.CONFIG_PATH}\n"
         )
-        console.print("Made with :heart: by [link=https://github.com/EthanLeitch]Ethan Leitch[/link].")
+        Console().print("Made with :heart: by [link=https://github.com/EthanLeitch]Ethan Leitch[/link].")
     else:
         with click.Context(main, info_name='ao3scraper.py') as ctx:
             click.echo(main.get_help(ctx))
 
 
-def scrape_urls():
-    # Check if AO3 is online / accessible
-    print("Checking if AO3 servers are online...")
-    try:
-        requests.get("https://archiveofourown.org", timeout=10)
-    except Timeout:
-        print("Could not reach AO3 servers. (Timeout)")
-        exit()
-    except ConnectionError:
-        print("Could not reach AO3 servers. (ConnectionError)")
-        exit()
-    else:
-        print("Contacted servers successfully.")
+def write_machine_output(output_format, scrape, scrape_all, shard, resume, cache, limit, offset, filters, sort, search):
+    """Writes the fics from --scrape, --cache or --list to stdout as JSON Lines or CSV."""
+    import contextlib
+    import sys
+    import output
 
-    # Create array of None that will be replaced later depending on the thread's index.
-    external_fics = [None for fic in fic_ids]
+    writer = output.create_writer(output_format, sys.stdout)
 
-    # The load_fic function that each thread performs
-    def load_fic(id):
-        try:
-            # Setup custom warning format
-            def custom_formatwarning(msg, *args, **kwargs):
-                if constants.WARNINGS:
-                    return f"(Work: {id}) Warning: {str(msg)}\n"
-                return ""
+    # Every other message goes to stderr, so that stdout only holds the rows.
+    with contextlib.redirect_stdout(sys.stderr):
+        if scrape:
+            scrape_urls(scrape_all, shard, resume, writer)
+        elif cache:
+            print_cached_table(writer)
+        else:
+            write_fic_list(writer, limit, offset, filters, sort, search)
 
-            warnings.formatwarning = custom_formatwarning
+    writer.close()
 
-            # Fetch fic's metadata
-            fic = AO3.Work(id).metadata
 
-            # Place each fic in correct array position. NOTE: This may not be particularly efficient as the entire list is enumerated by each thread.
-            for count, item in enumerate(fic_ids):
-                if fic["id"] == item:
-                    external_fics[count] = fic
+def start_profiler():
+    """Profiles the rest of the command. The stats are saved when ao3scraper exits, even if it exits early."""
+    import atexit
+    import cProfile
+    import pathlib
 
-        except Exception as e:
-            # print(f"{e} {id}")
-            for count, local_id in enumerate(fic_ids):
-                if id == local_id:
-                    if type(e) is AttributeError:
-                        e = "The work might be restricted (AttributeError)"
+    profiler = cProfile.Profile()
 
-                    external_fics[count] = ({'Exception': str(e), 'id': id})
+    def save_profile():
+        profiler.disable()
+        pathlib.Path(constants.DATA_PATH).mkdir(parents=True, exist_ok=True)
+        file_path = f"{constants.DATA_PATH}profile-{constants.NOW.strftime('%Y%m%d-%H%M%S')}.prof"
+        profiler.dump_stats(file_path)
+        print(f"Profile saved to {file_path} (view it with python -m pstats {file_path})")
 
-            progress.update(progress_bar, advance=1)
+    atexit.register(save_profile)
+    profiler.enable()
 
-        progress.update(progress_bar, advance=1)
 
-    # Track and create thread pool
-    with Progress() as progress:
-        progress_bar = progress.add_task("Fetching data from AO3...", total=len(fic_ids))
+def parse_shard(value):
+    """Converts --shard I/N into a (I, N) tuple."""
+
+    if value is None:
+        return None
+
+    try:
+        index, count = (int(number) for number in value.split('/'))
+    except ValueError:
+        raise click.BadParameter("must be in the form I/N, e.g. 1/4")
+
+    if not 1 <= index <= count:
+        raise click.BadParameter("I must be between 1 and N")
+
+    return index, count
+
+
+def parse_filters(values):
+    """Converts each --where FILTER into a dict of filters for database.select_fics."""
+    from datetime import datetime
+
+    filters = {}
+    for value in values:
+        name, _, argument = value.partition('=')
+        name = name.strip().lower()
+        argument = argument.strip()
+
+        if name == 'fandom' and argument:
+            filters['fandom'] = argument
+        elif name == 'status' and argument:
+            filters['status'] = argument
+        elif name in ('complete', 'stale'):
+            # stale on its own means stale=yes
+            if argument.lower() in ('', 'yes', 'true', '1'):
+                filters[name] = True
+            elif argument.lower() in ('no', 'false', '0'):
+                filters[name] = False
+            else:
+                raise click.BadParameter(f"{name} must be yes or no")
+        elif name in ('updated-since', 'updated_since'):
+            try:
+                filters['updated_since'] = datetime.strptime(argument, "%Y-%m-%d")
+            except ValueError:
+                raise click.BadParameter("updated-since must be a date in the form YYYY-MM-DD")
+        else:
+            raise click.BadParameter(f"{value} is not a filter. Use fandom=NAME, status=STATUS, complete=yes|no, stale=yes|no or updated-since=YYYY-MM-DD")
+
+    return filters
 
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            executor.map(load_fic, fic_ids)
 
-    # Handle adding of each fic
-    for count, fic in enumerate(external_fics):
+def search_order(search, sort):
+    """Returns the column the results of --search are sorted by (None for best matches first).
+    Exits with an error if search isn't a query the full-text index understands."""
+    import sys
+    import database
 
-        if 'Exception' in fic:
-            add_row(fic, count)
-            continue
+    try:
+        count = database.count_matches(search, database.RANKED_MATCHES + 1)
+    except database.SearchError as e:
+        print(e)
+        exit(1)
 
-        for value in fic:
-            # If type of entry is list, store it as comma-seperated string (e.g. "foo, bar").
-            if type(fic[value]) is list:
-                fic[value] = ", ".join(fic[value])
+    if sort is None and count > database.RANKED_MATCHES:
+        print(f"More than {database.RANKED_MATCHES} fics match \"{search}\", which is too many to rank, so they are listed by kudos.", file=sys.stderr)
+        return 'kudos'
 
-        # Strip leading and trailing whitespace from fic summaries.
-        fic['summary'] = fic['summary'].strip()
+    return sort
 
-        if type(local_fics[count]['nchapters']) is type(None):
-            add_row(fic, count)
-        elif int(fic['nchapters']) > int(local_fics[count]['nchapters']):
-            add_row(fic, count, styling=constants.UPDATED_STYLES)
-        else:
-            add_row(fic, count)
 
-        # Convert every value into string so it can be stored in the database.
-        for value in fic:
-            fic[value] = str(fic[value])
-        #fic = [str(fic[value]) for fic[value] in fic]
+def read_database():
+    """Reads every fic from the database."""
+    global fic_ids, local_fics
+    import database
+
+    fic_ids = database.get_fic_ids()
+    local_fics = database.get_all_fics()
+
 
-        # Update database
-        database.update_fic(fic, fic['id'])
+def create_table(title="Fanfics", index_name="Index"):
+    """Creates the rich table that add_row adds rows to, with the columns from TABLE_TEMPLATE."""
+    global table, args, formatters
+    from rich.table import Table
+
+    # Create columns of rich table
+    table = Table(title=title, show_lines=True)
+    table.add_column(index_name)
+
+    args = []
+    for i in constants.TABLE_TEMPLATE:
+        table.add_column(i["name"], style=i["styles"])
+        args.append(i["column"])
+
+    if formatters is None:
+        formatters = compile_formatters(constants.TABLE_TEMPLATE)
+
+
+def print_table(table, console=None):
+    from rich.console import Console
+
+    if console is None:
+        console = Console()
 
     # Print rich table
-    print()
+    console.print()
     console.print(table)
 
-    table.title = "Fanfics (cached)"
 
-    with open(constants.DATA_PATH + "table.pickle", 'wb') as file:
-        pickle.dump(table, file, protocol=pickle.HIGHEST_PROTOCOL)
+def open_pager():
+    """Starts the user's pager ($PAGER, or less). Pages are written to its stdin as they are rendered."""
+    import os
+    import shlex
+    import subprocess
+
+    command = os.environ.get("PAGER", "less -R")
+    return subprocess.Popen(shlex.split(command), stdin=subprocess.PIPE, text=True)
+
+
+def scrape_urls(scrape_all=False, shard=None, resume=False, writer=None):
+    """Scrapes the fics that are due (or every fic), saves them, and shows them as a table.
+    If writer is given (see output.py), the fics are written to it instead of being shown as a table."""
+    from rich.progress import Progress
+
+    import circuit_breaker
+    import database
+    import fetcher
+    import history
+    import metrics
+    import scheduler
+    import snapshot
+
+    read_database()
+    if writer is None:
+        create_table()
+
+    # Runs are recorded with their shard ("I/N"), so that each shard resumes its own.
+    shard_name = f"{shard[0]}/{shard[1]}" if shard is not None else None
+
+    if resume:
+        # Continue the last interrupted scrape (of this shard) with the fics it hadn't checked yet.
+        run_id = database.get_unfinished_run(shard_name)
+        if run_id is None:
+            print("There is no interrupted scrape to resume." if shard is None else f"Shard {shard_name} has no interrupted scrape to resume.")
+            exit()
+
+        due_ids = database.get_pending_ids(run_id)
+        print(f"Resuming scrape number {run_id}. {len(due_ids)} fics are left to check.")
+    else:
+        # Only fetch the fics that are due to be checked, unless every fic was asked for.
+        if scrape_all:
+            due_ids = fic_ids
+        else:
+            due_ids = scheduler.get_due_ids(local_fics)
+            print(f"{len(due_ids)} of {len(fic_ids)} fics are due to be checked.")
+
+        # Fics are split between shards by ID, so every invocation agrees on which fics are its own.
+        if shard is not None:
+            index, count = shard
+            due_ids = [fic_id for fic_id in due_ids if fic_id % count == index - 1]
+            print(f"Shard {index}/{count} will check {len(due_ids)} fics.")
+
+        # The due fics are saved with the run, so an interrupted scrape can be resumed.
+        run_id = database.start_run(due_ids, shard=shard_name)
+
+    local_fics_by_id = {fic['id']: fic for fic in local_fics}
+
+    # Only what the table needs is kept for each fetched fic: the number of new chapters, or the error.
+    flags = {}
+
+    # Fetched fics are saved CHECKPOINT_SIZE at a time, together with their changes and their removal from the run's pending fics.
+    scraped_fics = []
+    changes = []
+    done_ids = []
+    checked_count = changed_count = 0
+
+    def save_checkpoint():
+        nonlocal checked_count, changed_count
+        with metrics.timer('db_write'):
+            database.save_checkpoint(run_id, scraped_fics, changes, done_ids)
+        checked_count += len(done_ids)
+        changed_count += len(changes)
+        scraped_fics.clear()
+        changes.clear()
+        done_ids.clear()
+
+    # The load_fic function that is called as each fic finishes fetching
+    def load_fic(id, fic):
+        local_fic = local_fics_by_id[id]
+        done_ids.append(id)
+
+        if isinstance(fic, Exception):
+            e = fic
+            metrics.count('errors', type(e).__name__)
+            if type(e) is AttributeError:
+                e = "The work might be restricted (AttributeError)"
+
+            flags[id] = {'$error': str(e)}
+
+        elif fic is fetcher.UNCHANGED:
+            # The page or its metadata hasn't changed, so only the check itself is recorded.
+            scraped_fics.append(scheduler.record_check(local_fic, {'id': id}))
+
+        else:
+            if local_fic['nchapters'] is not None and int(fic['nchapters']) > int(local_fic['nchapters']):
+                flags[id] = {'$updated': int(fic['nchapters']) - int(local_fic['nchapters'])}
+
+            # Record the check, so the scheduler can learn how often this fic changes.
+            scheduler.record_check(local_fic, fic)
+
+            # Fics scraped for the first time have nothing to compare against.
+            if local_fic['date_updated'] is not None:
+                change = history.get_changes(local_fic, fic)
+                if change is not None:
+                    changes.append({'fic_id': id, **change})
+
+            scraped_fics.append(fic)
+
+        if len(done_ids) >= CHECKPOINT_SIZE:
+            save_checkpoint()
+
+        progress.update(progress_bar, advance=1)
+
+    # Track and run the fetch engine
+    try:
+        with Progress() as progress:
+            progress_bar = progress.add_task("Fetching data from AO3...", total=len(due_ids))
+
+            # Fics that are already in the database aren't parsed or saved again if their page or metadata hasn't changed.
+            digests = {fic['id']: fic['metadata_digest'] for fic in local_fics if fic['title'] is not None}
+            with metrics.timer('fetch'):
+                cache_stats = fetcher.fetch_all(due_ids, load_fic, digests)
+    except KeyboardInterrupt:
+        save_checkpoint()
+        save_metrics(run_id)
+        print(f"Scrape interrupted. {checked_count} of {len(due_ids)} fics were checked. Run ao3scraper --scrape --resume to continue.")
+        exit(1)
+    except circuit_breaker.CircuitOpenError as e:
+        # AO3 stopped answering, so the fics that weren't checked are left for --resume.
+        save_checkpoint()
+        save_metrics(run_id)
+        print(f"AO3 seems to be down ({e}) {checked_count} of {len(due_ids)} fics were checked. Run ao3scraper --scrape --resume to continue later.")
+        exit(1)
+
+    save_checkpoint()
+    database.finish_run(run_id)
+
+    # The table is built from the database, which now holds every fetched fic, so the results are never all held in memory twice.
+    def render_results():
+        for count, fic in enumerate(fic for page in database.iter_fics() for fic in page):
+            fic_flags = flags.get(fic['id'], {})
+
+            start = time.perf_counter()
+            if '$error' in fic_flags:
+                row = {'id': fic['id']}, fic_flags
+            else:
+                row = fic, {**fic_flags, '$stale': is_stale(fic)}
+
+            if writer is not None:
+                writer.write(*row)
+            elif '$error' in fic_flags:
+                add_row({'Exception': fic_flags['$error'], 'id': fic['id']}, count)
+            elif '$updated' in fic_flags:
+                add_row(fic, count, styling=constants.UPDATED_STYLES, difference=fic_flags['$updated'])
+            else:
+                add_row(fic, count)
+            metrics.observe('render', time.perf_counter() - start)
+
+            yield row
+
+    # The snapshot is written as the table is built.
+    snapshot.write_snapshot(render_results())
+
+    if writer is None:
+        with metrics.timer('print'):
+            print_table(table)
+    save_metrics(run_id)
+
+    if cache_stats is not None:
+        print(f"Page cache: {cache_stats['hits']} unchanged ({cache_stats['not_modified']} not modified), {cache_stats['misses']} changed or new.")
+
+    unchanged = metrics.summary()['counters'].get('unchanged', {})
+    print(f"{sum(unchanged.values())} unchanged fics weren't saved again ({unchanged.get('page', 0)} with the same page, {unchanged.get('metadata', 0)} with the same metadata).")
+    print(f"Saved as scrape number {run_id}. {changed_count} fics changed. (Run ao3scraper --changes {run_id - 1} to see them)")
+
+
+def save_metrics(run_id):
+    """Saves the run's metrics as JSON (and in Prometheus' format, if prometheus_file is set), and prints the request rate."""
+    import metrics
+
+    summary = metrics.summary()
+    file_path = metrics.write_json(run_id)
+    if constants.PROMETHEUS_FILE:
+        metrics.write_prometheus(constants.PROMETHEUS_FILE)
+
+    requests = summary['counters'].get('requests', 0)
+    retries = sum(summary['counters'].get('retries', {}).values())
+    print(f"{requests} requests ({summary.get('requests_per_second', 0)}/s, {retries} retries). Metrics saved to {file_path}")
 
 
 def add_url_multiple():
     message = click.edit(constants.MARKER + '\n')
 
     if message is not None:
-        message_lines = message.split(constants.MARKER, 1)[1].rstrip('\n').lstrip('\n')
-        urls_to_parse = message_lines.split('\n')
-
-        for count, item in enumerate(urls_to_parse):
-            entry_id = AO3.utils.workid_from_url(item)
-            if entry_id == None:
-                print(f"{item} is not a valid url.")
-            elif str(entry_id) in fic_ids:
-                print(item, "already in database.")
-            else:
-                database.add_fic(entry_id)
-                print("Added " + urls_to_parse[count])
+        message_lines = message.split(constants.MARKER, 1)[1]
+        import_urls(io.StringIO(message_lines))
 
     construct_rich_table()
 
 
+def import_urls(file):
+    """Adds every url in a file (one on each line) to the database, and prints and returns how many were added, duplicates
+    or invalid. The file is read one line at a time, and fics are added IMPORT_BATCH_SIZE at a time."""
+    import AO3
+    import database
+
+    added = duplicates = invalid = 0
+
+    # IDs seen earlier in the file. IDs already in the database are skipped by add_all_fics.
+    seen = set()
+    batch = []
+
+    def add_batch():
+        nonlocal added, duplicates
+        count = database.add_all_fics(batch)
+        added += count
+        duplicates += len(batch) - count
+        batch.clear()
+
+    for line in file:
+        url = line.strip()
+
+        # Skip blank lines and comments
+        if not url or url.startswith('#'):
+            continue
+
+        entry_id = AO3.utils.workid_from_url(url)
+        if entry_id is None:
+            print(f"{url} is not a valid url.")
+            invalid += 1
+        elif entry_id in seen:
+            duplicates += 1
+        else:
+            seen.add(entry_id)
+            batch.append(entry_id)
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                add_batch()
+
+    add_batch()
+
+    print(f"Added {added} fics. ({duplicates} already in database or duplicated, {invalid} invalid)")
+    return added, duplicates, invalid
+
+
 def add_url_single(entry):
+    import AO3
+    import database
+
     entry_id = AO3.utils.workid_from_url(entry)
 
     if entry_id == None:
         print(f"{entry} is not a valid url.")
-    elif str(entry_id) in str(fic_ids):
+    elif database.add_all_fics([entry_id]) == 0:
         print(f"{entry_id} already in database.")
     else:
-        database.add_fic(entry_id)
         print("Added", entry)
 
     construct_rich_table()
 
 
 def delete_entry(entry):
+    import database
+
+    read_database()
     try:
         # Decrease entry by one because Python arrays start at 0.
         target_entry = local_fics[(entry - 1)]
@@ -218,85 +533,229 @@ def delete_entry(entry):
     construct_rich_table()
 
 
-def construct_rich_table(read_again=True):
-    if read_again is True:
-        # Read database again
-        local_fics = database.get_all_fics()
+def start_daemon():
+    import daemon
 
-    for count, fic in enumerate(local_fics):
-        add_row(fic, count)
+    try:
+        daemon.run_daemon()
+    except daemon.DaemonError as e:
+        print(e)
+        exit(1)
 
-    # Print rich table
-    print()
-    console.print(table)
 
+def send_daemon_command(command):
+    """Sends a command such as "status", "add URL", "delete ID" or "stop" to the daemon, and prints its reply as JSON."""
+    import json
+    import daemon
+
+    name, _, argument = command.strip().partition(" ")
+    request = {'command': name}
+    if name == 'add':
+        request['url'] = argument
+    elif name == 'delete':
+        request['id'] = argument
 
-def print_cached_table():
-    with open(constants.DATA_PATH + "table.pickle", 'rb') as file:
-        table_cached = pickle.load(file)
-        print()
-        console.print(table_cached)
+    try:
+        reply = daemon.send_command(request)
+    except daemon.DaemonError as e:
+        print(e)
+        exit(1)
+
+    print(json.dumps(reply, indent=2))
+    if not reply.get('ok'):
+        exit(1)
+
+
+def construct_rich_table(limit=None, offset=0, use_pager=False, filters=None, sort=None, search=None):
+    global local_fics
+    import sys
+    from rich.console import Console
+    import database
+
+    # Positions only match --delete when every fic is listed in database order, so otherwise show work IDs.
+    show_ids = bool(filters or sort or search)
+    index_name = "Work ID" if show_ids else "Index"
+    create_table(title="Fanfics" if search is None else f"Fanfics matching \"{search}\"", index_name=index_name)
+
+    # Columns read from the database to list fics. add_row needs these on top of the ones shown in the table.
+    list_columns = {'title', 'date_published', 'date_updated'}
+    for column in args:
+        list_columns.update(CUSTOM_COLUMN_SOURCES.get(column, [column]))
+
+    console = Console()
+    pager = None
+    if use_pager and sys.stdout.isatty():
+        pager = open_pager()
+        console = Console(file=pager.stdin, force_terminal=True, width=console.width)
+
+    # Fics are read and rendered one page at a time, so the first page is shown without waiting for the rest.
+    count = offset
+    try:
+        for page in database.iter_fics(list_columns, constants.PAGE_SIZE, limit, offset, filters, sort, search):
+            local_fics = page
 
+            if count != offset:
+                create_table(title=None, index_name=index_name)
 
-def add_row(fic, count, styling=""):
-    # Copy the fic object so that changes made here are local, and not written to the database.
-    fic = copy.copy(fic)
+            for fic in page:
+                add_row(fic, count, show_id=show_ids)
+                count += 1
 
-    # Offset index by 1 because Python arrays start at 0.
-    index = str(count + 1)
+            print_table(table, console)
+
+        # Still show the (empty) table when there is nothing to list
+        if count == offset:
+            print_table(table, console)
+    except BrokenPipeError:
+        # The pager was closed before every page was shown, so stop reading the database.
+        pass
+    finally:
+        if pager is not None:
+            try:
+                pager.stdin.close()
+            except BrokenPipeError:
+                pass
+            pager.wait()
+
+
+def print_cached_table(writer=None):
+    import snapshot
+
+    if writer is None:
+        create_table(title="Fanfics (cached)")
+
+    # The snapshot holds the scraped data rather than the rendered table, so it is shown with the current TABLE_TEMPLATE.
+    try:
+        for count, fic in enumerate(snapshot.read_snapshot()):
+            if writer is not None:
+                writer.write(fic, fic)
+            elif fic['$error'] is not None:
+                add_row({'Exception': fic['$error'], 'id': fic['id']}, count)
+            elif fic['$updated']:
+                add_row(fic, count, styling=constants.UPDATED_STYLES, difference=fic['$updated'])
+            else:
+                add_row(fic, count)
+    except snapshot.SnapshotError as e:
+        print(e)
+        exit()
 
-    # Create AO3 link for fic
-    fic_link = f"https://archiveofourown.org/works/{fic['id']}"
+    if writer is None:
+        print_table(table)
+
+
+def write_fic_list(writer, limit=None, offset=0, filters=None, sort=None, search=None):
+    """Writes every fic in the database (or the ones matching filters and search) to writer, one page at a time."""
+    import database
+
+    for page in database.iter_fics(None, constants.PAGE_SIZE, limit, offset, filters, sort, search):
+        for fic in page:
+            writer.write(fic, {'$stale': is_stale(fic)})
+
+
+def print_changes(since):
+    from rich.table import Table
+    import database
+    import history
+
+    rows = database.get_changes_since(since)
+    latest = database.get_latest_run()
+
+    changes_table = Table(title=f"Changes since scrape {since} (last scrape: {latest})", show_lines=True)
+    changes_table.add_column("ID")
+    changes_table.add_column("Title", style="magenta")
+    for column in history.NUMBER_COLUMNS:
+        changes_table.add_column("Chapters" if column == 'nchapters' else column.capitalize(), style="green", justify="right")
+    changes_table.add_column("Status", style="violet")
+    changes_table.add_column("Scrapes")
+
+    for fic in history.combine_changes(rows):
+        # Deleted fics no longer have a title.
+        title = fic['title'] or "(deleted)"
+        numbers = [f"{fic[column]:+}" if column in fic else "" for column in history.NUMBER_COLUMNS]
+        changes_table.add_row(str(fic['fic_id']), f"[link=https://archiveofourown.org/works/{fic['fic_id']}]{title}[/link]",
+                              *numbers, fic.get('status', ""), str(fic['runs']))
+
+    print_table(changes_table)
+
+
+def is_stale(fic):
+    """Returns True if the fic hasn't been updated in more than STALE_THRESHOLD days."""
+
+    if fic['date_updated'] is None:
+        return False
+
+    return (constants.NOW - fic['date_updated']).days > constants.STALE_THRESHOLD
+
+
+def add_row(fic, count, styling="", difference=0, show_id=False):
+    # Offset index by 1 because Python arrays start at 0.
+    index = str(fic['id']) if show_id else f"{count + 1}."
 
     # If key 'Exception' in fic, display error information.
     if 'Exception' in fic:
-        table.add_row(f"{index}.", f"[link={fic_link}]ERROR: {fic['Exception']}[/link]", style="red")
+        table.add_row(index, f"[link={WORK_LINK}{fic['id']}]ERROR: {fic['Exception']}[/link]", style="red")
         return
 
     # Check if title or date_published field is empty. If it is, we assume that the fic has not yet been scraped.
     if fic['title'] is None or fic['date_published'] is None:
-        table.add_row(f"{index}.", f"[link={fic_link}]FIC DATA NOT YET SCRAPED[/link]", style=styling)
+        table.add_row(index, f"[link={WORK_LINK}{fic['id']}]FIC DATA NOT YET SCRAPED[/link]", style=styling)
         return
 
-    # Converting expected_chapters from None to '?' makes the "Chapters" column look nicer.
-    if fic['expected_chapters'] is None or fic['expected_chapters'] == "None":
-        fic['expected_chapters'] = '?'
-
-    # Turn upload date of fic into correct format
-    then = datetime.strptime(fic['date_updated'], constants.DATE_FORMAT)
+    # Only updated fics show the number of new chapters.
+    if styling != constants.UPDATED_STYLES:
+        difference = None
 
-    # Shorten date strings from YYYY-MM-DD XX:XX:XX to YYYY-MM-DD.
-    fic['date_published'] = fic['date_published'][:-9]
-    fic['date_edited'] = fic['date_edited'][:-9]
-    fic['date_updated'] = fic['date_updated'][:-9]
+    cells = [format_cell(fic, difference) for format_cell in formatters]
 
-    # Set $chapters to nchapters/expected_chapters (+difference)
-    if styling == constants.UPDATED_STYLES:
-        difference = int(fic['nchapters']) - int(local_fics[count]['nchapters'])
-        fic['$chapters'] = f"{fic['nchapters']}/{fic['expected_chapters']} (+{difference})"
+    if is_stale(fic):
+        table.add_row(index, *cells, style=constants.STALE_STYLES)
     else:
-        fic['$chapters'] = f"{fic['nchapters']}/{fic['expected_chapters']}"
+        table.add_row(index, *cells, style=styling)
 
-    # Get latest chapter title
-    fic['$latest_chapter'] = fic['chapter_titles'][-1]
 
-    # Trim every element to max_row_length
-    for data in fic:
-        if isinstance(fic[data], str):
-            fic[data] = (fic[data][:constants.MAX_ROW_LENGTH].strip() + '...') if len(fic[data]) > constants.MAX_ROW_LENGTH else fic[data]
+def compile_formatters(template):
+    """Turns TABLE_TEMPLATE into a list of functions, one for each column, that return that column's cell for a fic.
+    Each one only reads the fields its column needs, so add_row never has to copy or convert the whole fic."""
 
-    new_args = []
-    for count, zipped in enumerate(zip(args, constants.TABLE_TEMPLATE)):
-        if constants.TABLE_TEMPLATE[count]['column'] == 'title':
-            new_args.append(f"[link={fic_link}]{fic['title']}[/link]")
-        else:
-            new_args.append(fic[constants.TABLE_TEMPLATE[count]['column']])
-    new_args.insert(0, f"{index}.")
+    return [compile_formatter(item['column']) for item in template]
 
-    if (constants.NOW - then).days > constants.STALE_THRESHOLD:
-        table.add_row(*new_args, style=constants.STALE_STYLES)
-    else:
-        table.add_row(*new_args, style=styling)
+
+def compile_formatter(column):
+    """Returns a function that takes a fic and its number of new chapters (or None) and returns the column's cell."""
+
+    max_length = constants.MAX_ROW_LENGTH
+
+    # Trim text to max_row_length
+    def trim(value):
+        return value[:max_length].strip() + '...' if len(value) > max_length else value
+
+    if column == 'title':
+        return lambda fic, difference: f"[link={WORK_LINK}{fic['id']}]{trim(fic['title'])}[/link]"
+
+    if column == '$chapters':
+        # Set $chapters to nchapters/expected_chapters (+difference). Showing a missing expected_chapters as '?' looks nicer.
+        def format_chapters(fic, difference):
+            expected = fic['expected_chapters'] if fic['expected_chapters'] is not None else '?'
+            if difference is None:
+                return f"{fic['nchapters']}/{expected}"
+            return f"{fic['nchapters']}/{expected} (+{difference})"
+        return format_chapters
+
+    if column == '$latest_chapter':
+        # chapter_titles is stored as a comma-separated string, so the latest chapter is the part after the last comma.
+        return lambda fic, difference: trim(str(fic['chapter_titles']).rsplit(", ", 1)[-1])
+
+    if column == 'expected_chapters':
+        return lambda fic, difference: str(fic[column]) if fic[column] is not None else '?'
+
+    if column in constants.DATE_COLUMNS:
+        # Show dates as YYYY-MM-DD instead of YYYY-MM-DD XX:XX:XX.
+        return lambda fic, difference: fic[column].date().isoformat() if fic[column] is not None else "None"
+
+    if column in constants.INTEGER_COLUMNS or column in constants.BOOLEAN_COLUMNS:
+        return lambda fic, difference: str(fic[column])
+
+    return lambda fic, difference: trim(str(fic[column]))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,170 @@
+# This module stops every worker when AO3 stops answering, instead of letting each of them retry and time out on its own.
+
+"""
+The breaker has three states:
+- closed: requests are sent as usual. circuit_failures failed requests in a row open it. After a failure, no new
+  requests are sent until one sent after it succeeds or the requests in flight have finished, so at the start of an
+  outage only the requests that were already in flight fail.
+- open: no requests are sent. Workers wait until circuit_cooldown seconds have passed.
+- half-open: one worker sends a probe request while the others keep waiting. If it succeeds the breaker closes,
+  otherwise it opens again.
+A request fails if it times out, can't connect, or gets a 5xx response. Any other response (including 429, which is left
+to the rate limiter) means AO3 is up.
+"""
+
+import threading
+import time
+
+# Custom modules
+import constants
+import metrics
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+# 5xx responses mean AO3 (or something in front of it) is down, rather than that one work is broken.
+FAILURE_STATUSES = (500, 502, 503, 504)
+
+
+class CircuitOpenError(Exception):
+    """Raised by CircuitBreaker.acquire when AO3 is down, and requests should stop."""
+
+
+class CircuitBreaker:
+    """Shared by every worker, like the rate limiter.
+
+    If max_trips is given, acquire raises CircuitOpenError once the breaker has opened max_trips times in a row,
+    so a scrape can stop instead of waiting out a long outage.
+    """
+
+    def __init__(self, failure_threshold, cooldown, max_trips=None):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_trips = max_trips
+
+        self.state = CLOSED
+        self.failures = 0
+        self.trips = 0
+        self._opened = 0
+        self._failed_at = 0
+
+        # acquire numbers each request it lets through. The numbers of the last one sent that has failed, the failure
+        # that last opened the breaker, and the last probe are kept, so that outcomes of older requests can be told apart.
+        self._sent = 0
+        self._last_failed = 0
+        self._opening = 0
+        self._probe = 0
+        self._in_flight = set()
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """Blocks while the breaker is open, then returns a ticket to pass to success or failure with the request's outcome.
+        Raises CircuitOpenError if the breaker has given up or has been closed."""
+
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise CircuitOpenError("The circuit breaker was closed.")
+
+                if self.max_trips is not None and self.trips >= self.max_trips:
+                    raise CircuitOpenError(f"AO3 failed {self.failures} requests in a row.")
+
+                if self.state == CLOSED:
+                    # A request that never reported back (see release) only holds the others up for one cooldown.
+                    wait = self._failed_at + self.cooldown - time.monotonic()
+                    if self.failures == 0 or not self._in_flight or wait <= 0:
+                        return self._ticket()
+
+                    self._condition.wait(wait)
+                    continue
+
+                # The first worker to wake after the cooldown sends the probe. The others wait for its result,
+                # or for another cooldown if the probe never reports back.
+                wait = self._opened + self.cooldown - time.monotonic()
+                if wait <= 0:
+                    self.state = HALF_OPEN
+                    self._opened = time.monotonic()
+                    self._probe = self._ticket()
+                    return self._probe
+
+                self._condition.wait(wait)
+
+    def _ticket(self):
+        self._sent += 1
+        self._in_flight.add(self._sent)
+        return self._sent
+
+    def _finished(self, ticket):
+        self._in_flight.discard(ticket)
+        # Workers held back after a failure wait for the requests in flight to finish.
+        if self.failures:
+            self._condition.notify_all()
+
+    def release(self, ticket):
+        """Records a request that ended without an answer either way, such as one that raised an unexpected error."""
+
+        with self._condition:
+            self._finished(ticket)
+
+    def success(self, ticket):
+        """Records a request that AO3 answered. If it was the probe, the breaker closes."""
+
+        with self._condition:
+            self._finished(ticket)
+
+            # Requests sent before the breaker opened can still finish while it's open. Only the probe can close it.
+            if self.state == OPEN or (self.state == HALF_OPEN and ticket < self._probe):
+                return
+
+            # Likewise, a request sent before one that has already failed says nothing about whether AO3 is up now.
+            # Otherwise, at the start of an outage, the requests still in flight from before it would keep resetting
+            # the count, and the breaker would let many more requests through before it opened.
+            if self.state == CLOSED and ticket < self._last_failed:
+                return
+
+            self.failures = 0
+            self.trips = 0
+            self.state = CLOSED
+            self._condition.notify_all()
+
+    def failure(self, ticket):
+        """Records a failed request. Opens the breaker after failure_threshold failures in a row, or if the probe failed."""
+
+        with self._condition:
+            self._finished(ticket)
+
+            # Requests sent before the breaker opened can also time out after it has opened. They say nothing about
+            # whether AO3 is back, and mustn't be taken for the probe failing.
+            if (self.state == HALF_OPEN and ticket < self._probe) or (self.state == OPEN and ticket < self._opening):
+                return
+
+            self.failures += 1
+            self._last_failed = max(self._last_failed, ticket)
+            self._failed_at = time.monotonic()
+
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                self.state = OPEN
+                self._opening = ticket
+                self.trips += 1
+                self._opened = time.monotonic()
+                metrics.count('circuit_trips')
+                self._condition.notify_all()
+
+    def close(self):
+        """Wakes every waiting worker and makes them raise CircuitOpenError."""
+
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+
+def create_breaker(max_trips=None):
+    """Creates a CircuitBreaker from the thresholds in config.yaml."""
+
+    return CircuitBreaker(
+        failure_threshold=constants.CIRCUIT_FAILURES,
+        cooldown=constants.CIRCUIT_COOLDOWN,
+        max_trips=max_trips,
+    )
@@ -5,16 +5,12 @@ from os import environ
 from platformdirs import user_data_dir, user_config_dir
 from datetime import datetime
 from importlib import metadata
-from yaml import load, Loader
-
-# Custom modules
-import file_validator
 
 # Set important constants!
 APP_NAME = "ao3scraper"
 APP_AUTHOR = "EthanLeitch"
 APP_VERSION = '1.0.3' #metadata.version(APP_NAME)
-ALEMBIC_VERSION = 'ca2dfefaf0b6'
+ALEMBIC_VERSION = '7c5e2b8a4d16'
 
 DATA_PATH = path.join(user_data_dir(APP_NAME, APP_AUTHOR)) + "/"
 CONFIG_PATH = path.join(user_config_dir(APP_NAME, APP_AUTHOR)) + "/"
@@ -26,12 +22,52 @@ CONFIG_FILE_PATH = CONFIG_PATH + "config.yaml"
 environ.setdefault("DATABASE_FILE_PATH", DATABASE_FILE_PATH)
 
 CONFIG_TEMPLATE = """
+# Scraping
+concurrency: 5
+max_connections_per_host: 5
+# Processes used to parse pages (1 parses them in the same process)
+processes: 1
+
+# Cache of work pages, in MB (0 disables it)
+http_cache_size: 100
+
+# Rate limiting (requests per second adapts between the min and max)
+requests_per_second: 1
+min_requests_per_second: 0.1
+max_requests_per_second: 5
+burst: 5
+max_retries: 5
+backoff_base: 2
+backoff_max: 120
+
+# Circuit breaker (after circuit_failures failed requests in a row, every worker waits circuit_cooldown seconds
+# before one request is tried again. A scrape stops if that fails circuit_max_trips times in a row)
+circuit_failures: 5
+circuit_cooldown: 30
+circuit_max_trips: 3
+
+# Incremental scraping (intervals are in days, a scrape_budget of 0 means no limit)
+scrape_budget: 0
+min_check_interval: 1
+max_check_interval: 30
+complete_check_multiplier: 4
+
+# Daemon (--daemon): requests it may send per hour
+daemon_requests_per_hour: 600
+
+# Database
+sqlite_wal: true
+
+# Metrics (set prometheus_file to a path to also save them in Prometheus' text format)
+prometheus_file: ''
+
 # Formatting of table
 max_row_length: 120
 warnings: false
 stale_threshold: 60
 stale_styles: deep_sky_blue4
 updated_styles: '#ffcc33 bold'
+page_size: 50
 
 # Column attributes
 table_template:
@@ -57,28 +93,30 @@ This is done in construct_list.py
 TABLE_COLUMNS = ['date_edited', 'date_published', 'date_updated', 'bookmarks', 'categories', 'nchapters', 'characters', 'complete', 'comments', 'expected_chapters', 'fandoms', 'hits', 'kudos', 'language', 'rating', 'relationships', 'restricted', 'status', 'summary', 'tags', 'title', 'warnings', 'words', 'collections', 'authors', 'series', 'chapter_titles']
 CUSTOM_COLUMNS = ['$chapters', '$latest_chapter']
 
-# Check that config.yaml and fics.db exist
-file_validator.main()
-
-# Load user's custom preferences from config.yaml
-with open(CONFIG_FILE_PATH, 'r') as file:
-    config_file = load(file, Loader=Loader)
+# Column types in the database. Every other column in TABLE_COLUMNS is stored as TEXT.
+INTEGER_COLUMNS = ['bookmarks', 'nchapters', 'comments', 'expected_chapters', 'hits', 'kudos', 'words']
+BOOLEAN_COLUMNS = ['complete', 'restricted']
+DATE_COLUMNS = ['date_edited', 'date_published', 'date_updated']
 
-# Load each preference as a constant variable
-MAX_ROW_LENGTH = config_file['max_row_length']
-WARNINGS = config_file['warnings']
-STALE_THRESHOLD = config_file['stale_threshold']
-STALE_STYLES = config_file['stale_styles']
-UPDATED_STYLES = config_file['updated_styles']
-TABLE_TEMPLATE = config_file['table_template']
-
-# Check that all the columns listed in the config file are valid
-for i in TABLE_TEMPLATE:
-    if i['column'] not in TABLE_COLUMNS and i['column'] not in CUSTOM_COLUMNS:
-        print(f"{i['column']} is not a valid column.")
+# Columns in the full-text index used by --search
+SEARCH_COLUMNS = ['title', 'summary', 'tags', 'characters', 'relationships']
 
 # Other constants
 MARKER = "# Enter one url on each line to add it to the database. This line will not be recorded."
 
 DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
 NOW = datetime.now()
+
+# Can be pointed at a local server serving recorded AO3 pages.
+AO3_URL = environ.get("AO3SCRAPER_URL", "https://archiveofourown.org")
+
+
+def __getattr__(name):
+    """Preferences from config.yaml (MAX_ROW_LENGTH, TABLE_TEMPLATE, etc.) are only loaded the first time one is used.
+    This means commands like --version and --help never have to create or read the config file."""
+
+    if name.startswith('_'):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    import preferences
+    return getattr(preferences, name)
@@ -0,0 +1,319 @@
+# This module runs ao3scraper as a long-running process that checks each fic as it becomes due, instead of scraping everything at once from cron.
+
+"""
+The daemon keeps its HTTP connections, rate limiter and page cache open between checks, and keeps every fic's
+scheduling fields in memory, in a queue ordered by when each fic is next due.
+It is controlled through a Unix socket (SOCKET_PATH). Each request and reply is one line of JSON:
+- {"command": "status"}
+- {"command": "add", "url": "https://archiveofourown.org/works/..."}
+- {"command": "delete", "id": 12345}
+- {"command": "stop"}
+"""
+
+import asyncio
+import heapq
+import json
+import os
+import signal
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+# Custom modules
+import circuit_breaker
+import constants
+import database
+import fetcher
+import history
+import http_cache
+import rate_limiter
+import scheduler
+
+SOCKET_PATH = constants.DATA_PATH + "daemon.sock"
+
+# The columns the daemon keeps in memory: the ones the scheduler and history.get_changes need.
+COLUMNS = ['title', 'date_updated', 'complete', 'last_checked', 'times_checked', 'times_changed', 'metadata_digest'] + history.TRACKED_COLUMNS
+
+# Changes are recorded in a new run every RUN_LENGTH, so --changes still works while the daemon runs.
+RUN_LENGTH = timedelta(hours=1)
+
+# The page cache is trimmed to http_cache_size every CACHE_TRIM_INTERVAL checks.
+CACHE_TRIM_INTERVAL = 100
+
+
+class DaemonError(Exception):
+    """Raised when the daemon can't be started or reached."""
+
+
+class Daemon:
+    def __init__(self):
+        # Every fic in the database, keyed by ID
+        self.fics = {}
+
+        # (due, id) pairs, soonest first. A fic's entry is only current if due matches self.due[id]; older entries are skipped.
+        self.queue = []
+        self.due = {}
+
+        # IDs currently being fetched, so a fic added twice isn't fetched twice at once
+        self.fetching = set()
+
+        self.started = datetime.now()
+        self.stats = {'checked': 0, 'changed': 0, 'errors': 0}
+
+    def load(self):
+        """Reads every fic's scheduling fields from the database and queues them."""
+
+        for fic in database.get_all_fics(COLUMNS):
+            self.fics[fic['id']] = fic
+            self.schedule(fic, scheduler.next_check(fic, self.started))
+
+    def schedule(self, fic, due):
+        self.due[fic['id']] = due
+        heapq.heappush(self.queue, (due, fic['id']))
+        self.wakeup.set()
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        self.stopping = asyncio.Event()
+
+        self.load()
+        self.run_id = database.start_run([], self.started)
+        self.run_started = self.started
+
+        # The daemon's request budget caps the rate limiter, on top of the scraping rate limits.
+        budget = constants.DAEMON_REQUESTS_PER_HOUR / 3600
+        self.limiter = rate_limiter.RateLimiter(
+            min(constants.REQUESTS_PER_SECOND, budget), 1, min(constants.MIN_REQUESTS_PER_SECOND, budget), min(constants.MAX_REQUESTS_PER_SECOND, budget)
+        )
+        self.cache = http_cache.ResponseCache() if constants.HTTP_CACHE_SIZE else None
+
+        # The daemon never gives up on an outage: it keeps probing AO3 every circuit_cooldown seconds.
+        self.breaker = circuit_breaker.create_breaker()
+
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            self.loop.add_signal_handler(signal_number, self.stopping.set)
+
+        server = await asyncio.start_unix_server(self.handle_client, SOCKET_PATH)
+        print(f"Watching {len(self.fics)} fics. Control socket: {SOCKET_PATH}")
+
+        try:
+            with fetcher.create_session() as self.session, ThreadPoolExecutor(max_workers=constants.CONCURRENCY) as self.executor:
+                workers = [asyncio.create_task(self.worker()) for _ in range(constants.CONCURRENCY)]
+                await self.stopping.wait()
+
+                # Closing the limiter and breaker wakes the fetches that are waiting for them, so the executor can shut down straight away.
+                print("Stopping...")
+                self.limiter.close()
+                self.breaker.close()
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+        finally:
+            server.close()
+            await server.wait_closed()
+            os.unlink(SOCKET_PATH)
+
+            database.finish_run(self.run_id)
+            if self.cache is not None:
+                self.cache.close()
+
+    async def next_due(self):
+        """Waits until a fic is due, and returns its ID."""
+
+        while True:
+            # Skip entries for deleted fics, fics that have been rescheduled, and fics that are already being fetched.
+            while self.queue and (self.due.get(self.queue[0][1]) != self.queue[0][0] or self.queue[0][1] in self.fetching):
+                heapq.heappop(self.queue)
+
+            self.wakeup.clear()
+
+            if self.queue:
+                due, fic_id = self.queue[0]
+                delay = (due - datetime.now()).total_seconds()
+                if delay <= 0:
+                    heapq.heappop(self.queue)
+                    del self.due[fic_id]
+                    return fic_id
+            else:
+                delay = None
+
+            # Wait until the first fic is due, or until another fic is queued.
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def worker(self):
+        while True:
+            fic_id = await self.next_due()
+            fic = self.fics.get(fic_id)
+            if fic is None:
+                continue
+
+            self.fetching.add(fic_id)
+            try:
+                result = await self.loop.run_in_executor(
+                    self.executor, fetcher.fetch_metadata, fic_id, self.session, self.limiter, self.cache,
+                    fic['title'] is not None, None, self.breaker, fic['metadata_digest']
+                )
+            except Exception as e:
+                result = e
+            finally:
+                self.fetching.discard(fic_id)
+
+            self.save_result(fic_id, result)
+
+    def save_result(self, fic_id, result):
+        """Saves a fetched fic to the database straight away, and queues its next check."""
+
+        now = datetime.now()
+        local_fic = self.fics.get(fic_id)
+
+        # The fic was deleted while it was being fetched.
+        if local_fic is None:
+            return
+
+        self.stats['checked'] += 1
+
+        if isinstance(result, Exception):
+            # Errors aren't saved, as in --scrape. The fic is tried again after the shortest interval.
+            self.stats['errors'] += 1
+            print(f"{fic_id}: {type(result).__name__}: {result}")
+            self.schedule(local_fic, now + timedelta(days=constants.MIN_CHECK_INTERVAL))
+            return
+
+        if result is fetcher.UNCHANGED:
+            row = scheduler.record_check(local_fic, {'id': fic_id}, now)
+        else:
+            row = scheduler.record_check(local_fic, result, now)
+
+        changes = []
+        if 'date_updated' in row and local_fic['date_updated'] is not None:
+            change = history.get_changes(local_fic, row)
+            if change is not None:
+                changes.append({'fic_id': fic_id, **change})
+                self.stats['changed'] += 1
+                print(f"{fic_id}: {row['title']} changed {change}")
+
+        if now - self.run_started >= RUN_LENGTH:
+            database.finish_run(self.run_id)
+            self.run_id = database.start_run([], now)
+            self.run_started = now
+
+        database.save_checkpoint(self.run_id, [row], changes, [])
+
+        local_fic.update({column: row[column] for column in COLUMNS if column in row})
+        self.schedule(local_fic, scheduler.next_check(local_fic, now))
+
+        if self.cache is not None and self.stats['checked'] % CACHE_TRIM_INTERVAL == 0:
+            self.cache.trim()
+
+    async def handle_client(self, reader, writer):
+        """Answers each request a client sends until it disconnects."""
+
+        try:
+            while line := await reader.readline():
+                try:
+                    request = json.loads(line)
+                    reply = self.handle_request(request)
+                except Exception as e:
+                    reply = {'ok': False, 'error': str(e)}
+
+                writer.write((json.dumps(reply, default=str) + "\n").encode())
+                await writer.drain()
+        except (asyncio.CancelledError, ConnectionError):
+            # The daemon is stopping, or the client went away.
+            pass
+        finally:
+            writer.close()
+
+    def handle_request(self, request):
+        command = request.get('command')
+
+        if command == 'status':
+            return {'ok': True, **self.status()}
+
+        if command == 'add':
+            import AO3
+
+            fic_id = AO3.utils.workid_from_url(request.get('url', ''))
+            if fic_id is None:
+                return {'ok': False, 'error': f"{request.get('url')} is not a valid url."}
+            if not database.add_all_fics([fic_id]):
+                return {'ok': False, 'error': f"{fic_id} already in database."}
+
+            # A new fic has never been checked, so it is due straight away.
+            fic = {column: None for column in COLUMNS}
+            fic['id'] = fic_id
+            self.fics[fic_id] = fic
+            self.schedule(fic, datetime.now())
+            return {'ok': True, 'id': fic_id}
+
+        if command == 'delete':
+            try:
+                fic_id = int(request.get('id'))
+            except (TypeError, ValueError):
+                return {'ok': False, 'error': f"{request.get('id')} is not a fic ID."}
+            if fic_id not in self.fics:
+                return {'ok': False, 'error': f"{fic_id} is not in the database."}
+
+            database.delete_fic(fic_id)
+            del self.fics[fic_id]
+            self.due.pop(fic_id, None)
+            return {'ok': True, 'id': fic_id}
+
+        if command == 'stop':
+            self.stopping.set()
+            return {'ok': True}
+
+        return {'ok': False, 'error': f"Unknown command: {command}"}
+
+    def status(self):
+        now = datetime.now()
+        upcoming = sorted(item for item in self.queue if self.due.get(item[1]) == item[0])
+
+        return {
+            'pid': os.getpid(),
+            'started': self.started.strftime(constants.DATE_FORMAT),
+            'run': self.run_id,
+            'fics': len(self.fics),
+            'due_now': sum(1 for due, fic_id in upcoming if due <= now),
+            'next_due': upcoming[0][0].strftime(constants.DATE_FORMAT) if upcoming else None,
+            'fetching': len(self.fetching),
+            'requests_per_second': round(self.limiter.rate, 4),
+            'circuit': self.breaker.state,
+            **self.stats,
+        }
+
+
+def run_daemon():
+    """Runs the daemon until it is stopped with Ctrl-C, SIGTERM or the stop command."""
+
+    if not hasattr(asyncio, 'start_unix_server'):
+        raise DaemonError("The daemon needs Unix sockets, which aren't available on this platform.")
+
+    if os.path.exists(SOCKET_PATH):
+        try:
+            send_command({'command': 'status'})
+        except DaemonError:
+            # Left behind by a daemon that didn't exit cleanly
+            os.unlink(SOCKET_PATH)
+        else:
+            raise DaemonError("The daemon is already running.")
+
+    asyncio.run(Daemon().run())
+
+
+def send_command(request):
+    """Sends a request to the running daemon and returns its reply."""
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.connect(SOCKET_PATH)
+            client.sendall((json.dumps(request) + "\n").encode())
+            reply = client.makefile('r').readline()
+    except (FileNotFoundError, ConnectionRefusedError):
+        raise DaemonError("The daemon isn't running. Start it with ao3scraper --daemon.")
+
+    return json.loads(reply)
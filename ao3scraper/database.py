@@ -5,19 +5,34 @@ import sqlalchemy as db
 from sqlalchemy import MetaData
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.ext.hybrid import hybrid_property
-from sqlalchemy import Integer, String
+from sqlalchemy import Integer, String, Boolean
+from sqlalchemy.dialects.sqlite import DATETIME
 
 from sqlalchemy.orm import Session, sessionmaker
-from sqlalchemy import inspect, select, update, delete, values
+from sqlalchemy.exc import OperationalError
+from sqlalchemy import inspect, select, insert, update, delete, values, bindparam, event
 
-# marshmallow
-from marshmallow_sqlalchemy import SQLAlchemyAutoSchema
+from datetime import datetime, timedelta
+from functools import lru_cache
 
 # Custom modules
 import constants
+import file_validator
+import history
+
+# Check that fics.db exists and is on the right revision before connecting to it
+file_validator.check_database()
 
 engine = db.create_engine(f'sqlite:///{constants.DATABASE_FILE_PATH}')
-connection = engine.connect()
+
+# WAL mode lets readers and a writer work at the same time, and with synchronous=NORMAL a commit no longer waits for an fsync.
+if constants.SQLITE_WAL:
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragma(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
 
 Base = declarative_base()
 metadata = MetaData()
@@ -25,22 +40,114 @@ metadata = MetaData()
 # Setup sessionmaker so we don't need to use Session(engine) every time
 Session = sessionmaker(engine)
 
+# Dates are stored in the same format they were stored in as TEXT (YYYY-MM-DD HH:MM:SS), and read back as datetime objects.
+DateTime = DATETIME(
+    storage_format="%(year)04d-%(month)02d-%(day)02d %(hour)02d:%(minute)02d:%(second)02d",
+    regexp=r"(\d+)-(\d+)-(\d+) (\d+):(\d+):(\d+)",
+)
+
+def column_type(column):
+    """Returns the SQLAlchemy type of a column in TABLE_COLUMNS."""
+
+    if column in constants.INTEGER_COLUMNS:
+        return Integer
+    if column in constants.BOOLEAN_COLUMNS:
+        return Boolean
+    if column in constants.DATE_COLUMNS:
+        return DateTime
+    return String
+
 # Create fanfic class
 class Fanfic(Base):
     __tablename__ = "fics"
 
     id = db.Column(Integer, primary_key=True, unique=True)
 
-# Add each item in TABLE_COLUMNS to the database as a db.Column(String) object.
+    # Scheduling columns (see scheduler.py)
+    last_checked = db.Column(DateTime)
+    times_checked = db.Column(Integer, default=0)
+    times_changed = db.Column(Integer, default=0)
+
+    # Hash of the fic's saved metadata, so a scrape can tell that nothing changed without writing it again (see fetcher.py)
+    metadata_digest = db.Column(String)
+
+# Add each item in TABLE_COLUMNS to the database as a db.Column object of its type.
 for column in constants.TABLE_COLUMNS:
-    setattr(Fanfic, column, db.Column(String))
+    setattr(Fanfic, column, db.Column(column_type(column)))
+
+# Scrape history (see history.py)
+class Run(Base):
+    __tablename__ = "runs"
+
+    id = db.Column(Integer, primary_key=True)
+    started = db.Column(DateTime)
+    finished = db.Column(DateTime)
+
+    # --shard I/N (e.g. "1/4"), or NULL if the scrape wasn't sharded
+    shard = db.Column(String)
+
+class FicChange(Base):
+    __tablename__ = "fic_history"
+    __table_args__ = {'sqlite_with_rowid': False}
+
+    run_id = db.Column(Integer, primary_key=True)
+    fic_id = db.Column(Integer, primary_key=True)
+
+    # The difference since the previous scrape, or NULL if the column didn't change
+    kudos = db.Column(Integer)
+    hits = db.Column(Integer)
+    words = db.Column(Integer)
+    nchapters = db.Column(Integer)
+
+    # The new status, or NULL if it didn't change
+    status = db.Column(String)
+
+class PendingFic(Base):
+    __tablename__ = "pending_fics"
+    __table_args__ = {'sqlite_with_rowid': False}
+
+    # The fics a scrape hasn't checked yet. They are removed as they are saved, so an interrupted scrape can be resumed.
+    run_id = db.Column(Integer, primary_key=True)
+    fic_id = db.Column(Integer, primary_key=True)
+
+class FicFandom(Base):
+    __tablename__ = "fic_fandoms"
+    __table_args__ = {'sqlite_with_rowid': False}
+
+    # One row for each of a fic's fandoms, so --list --where fandom=... can use an index (ix_fic_fandoms_fandom)
+    # instead of searching every fic's fandoms string.
+    fic_id = db.Column(Integer, primary_key=True)
+    fandom = db.Column(String(collation='NOCASE'), primary_key=True)
+
+# --list --sort columns. Each has an index, and fics are listed highest or newest first.
+SORT_COLUMNS = ['kudos', 'words', 'date_updated']
+
+# The full-text index used by --search (created in file_validator.py). It is an FTS5 table over constants.SEARCH_COLUMNS
+# of fics, kept up to date by triggers on fics. Its rowid is the fic's id, and rank orders matches best first.
+fics_fts = db.table('fics_fts', db.column('rowid'), db.column('rank'), db.column('fics_fts'))
+
+# Ranking by relevance (bm25) costs a few microseconds for every match, so searches matching more fics than this
+# are sorted by an indexed column instead. Words that common barely change the relevance of a match anyway.
+RANKED_MATCHES = 10000
+
+
+class SearchError(Exception):
+    """Raised when a --search query can't be searched for."""
 
 # Create Schema for serialization via Marshmallow.
-class FanficSchema(SQLAlchemyAutoSchema):
-    class Meta:
-        model = Fanfic
-        include_relationships = True
-        load_instance = True
+@lru_cache(maxsize=None)
+def get_fanfic_schema():
+    """Returns the FanficSchema class. marshmallow is slow to import and only get_fic uses it, so it is created on first use."""
+
+    from marshmallow_sqlalchemy import SQLAlchemyAutoSchema
+
+    class FanficSchema(SQLAlchemyAutoSchema):
+        class Meta:
+            model = Fanfic
+            include_relationships = True
+            load_instance = True
+
+    return FanficSchema
 
 
 def add_fic(fic_id):
@@ -49,30 +156,156 @@ def add_fic(fic_id):
         session.add(Fanfic(id=fic_id))
         session.commit()
 
-def add_all_fics(fic_id):
-    """Adds multiple new fics to the database. (Input needs to be list)"""
+def add_all_fics(fic_ids):
+    """Adds multiple new fics to the database in one transaction, and returns how many were added. (Input needs to be list)
+    IDs that are already in the database are skipped."""
 
-    # https://stackoverflow.com/questions/7889183/sqlalchemy-insert-or-update-example
-    with Session() as session:
-        session.add_all(Fanfic(id=fic_id))
-        session.commit()
+    if not fic_ids:
+        return 0
 
+    stmt = insert(Fanfic).prefix_with("OR IGNORE")
 
-def update_fic(fic, fic_id):
-    """Updates all fics with scraped data."""
+    with engine.begin() as conn:
+        result = conn.execute(stmt, [{'id': fic_id} for fic_id in fic_ids])
+        return result.rowcount
 
-    with Session() as session:
-        stmt = update(Fanfic).where(Fanfic.id == int(fic_id)).values(fic)
-        session.execute(stmt)
-        session.commit()
+
+def update_all_fics(fics):
+    """Updates many fics with scraped data in a single transaction. (Input needs to be a list of dicts with an 'id' key)"""
+
+    with engine.begin() as conn:
+        write_fics(conn, fics)
+
+
+def write_fics(conn, fics):
+    """Writes scraped fics using an existing connection, so the caller decides when the transaction is committed."""
+
+    # executemany needs every row to set the same columns, so group the fics by the columns they have.
+    groups = {}
+    for fic in fics:
+        row = {key: value for key, value in fic.items() if key != 'id'}
+        row['fic_id'] = int(fic['id'])
+        groups.setdefault(tuple(sorted(row)), []).append(row)
+
+    # The SET clause is built from the keys of each group's rows.
+    stmt = update(Fanfic).where(Fanfic.id == bindparam('fic_id'))
+
+    for rows in groups.values():
+        conn.execute(stmt, rows)
+
+    # Keep fic_fandoms in step with the fandoms of the fics that were scraped.
+    scraped = [{'fic_id': int(fic['id'])} for fic in fics if 'fandoms' in fic]
+    if scraped:
+        conn.execute(delete(FicFandom).where(FicFandom.fic_id == bindparam('fic_id')), scraped)
+
+    fandoms = [{'fic_id': int(fic['id']), 'fandom': fandom} for fic in fics if fic.get('fandoms') for fandom in split_fandoms(fic['fandoms'])]
+    if fandoms:
+        conn.execute(insert(FicFandom).prefix_with("OR IGNORE"), fandoms)
+
+
+def split_fandoms(fandoms):
+    """Splits a fandoms string (as stored in fics, e.g. "foo, bar") into a list of fandoms."""
+
+    return [fandom for fandom in fandoms.split(", ") if fandom]
+
+
+def start_run(fic_ids, started=None, shard=None):
+    """Records the start of a scrape that will check fic_ids, and returns the run's ID.
+    shard is the --shard the scrape was run with (e.g. "1/4")."""
+
+    if started is None:
+        started = constants.NOW
+
+    with engine.begin() as conn:
+        run_id = conn.execute(insert(Run).values(started=started, shard=shard)).inserted_primary_key[0]
+        if fic_ids:
+            conn.execute(insert(PendingFic), [{'run_id': run_id, 'fic_id': fic_id} for fic_id in fic_ids])
+
+    return run_id
+
+
+def save_checkpoint(run_id, fics, changes, done_ids):
+    """Saves scraped fics and their changes, and removes done_ids from the run's pending fics, all in one transaction.
+    (fics needs to be a list of dicts with an 'id' key, and changes a list of dicts with a 'fic_id' key)"""
+
+    with engine.begin() as conn:
+        write_fics(conn, fics)
+
+        # executemany needs every row to set the same columns, so columns that didn't change are set to NULL.
+        rows = [{'run_id': run_id, **{column: None for column in history.TRACKED_COLUMNS}, **change} for change in changes]
+        if rows:
+            conn.execute(insert(FicChange), rows)
+
+        if done_ids:
+            stmt = delete(PendingFic).where(PendingFic.run_id == run_id, PendingFic.fic_id == bindparam('done_id'))
+            conn.execute(stmt, [{'done_id': fic_id} for fic_id in done_ids])
+
+
+def finish_run(run_id):
+    """Marks a scrape as finished, so it can no longer be resumed."""
+
+    with engine.begin() as conn:
+        conn.execute(update(Run).where(Run.id == run_id).values(finished=datetime.now()))
+        conn.execute(delete(PendingFic).where(PendingFic.run_id == run_id))
+
+
+def get_unfinished_run(shard=None):
+    """Returns the ID of the last scrape run with shard (see start_run) that was interrupted, or None if there isn't one.
+    Shards run at the same time, so each one only resumes its own scrapes."""
+
+    # Only runs with fics left to check can be resumed. The daemon's runs never have any, and stay unfinished while it
+    # runs (or forever if it was killed), so they would otherwise hide any scrape that was interrupted before them.
+    pending = select(PendingFic.fic_id).where(PendingFic.run_id == Run.id).exists()
+
+    # (Run.shard == None is IS NULL in SQL)
+    stmt = select(Run.id).where(Run.finished.is_(None), Run.shard == shard, pending)
+
+    with engine.connect() as conn:
+        return conn.execute(stmt.order_by(Run.id.desc()).limit(1)).scalar()
+
+
+def get_pending_ids(run_id):
+    """Returns the IDs of the fics a scrape hasn't checked yet. Fics deleted since the scrape started are left out."""
+
+    stmt = (
+        select(PendingFic.fic_id)
+        .join(Fanfic, Fanfic.id == PendingFic.fic_id)
+        .where(PendingFic.run_id == run_id)
+        .order_by(PendingFic.fic_id)
+    )
+    with engine.connect() as conn:
+        return conn.execute(stmt).scalars().all()
+
+
+def get_changes_since(run_id):
+    """Returns every change recorded after run_id, with the fic's title, ordered by fic and then by run."""
+
+    stmt = (
+        select(FicChange.__table__, Fanfic.title)
+        .outerjoin(Fanfic, Fanfic.id == FicChange.fic_id)
+        .where(FicChange.run_id > run_id)
+        .order_by(FicChange.fic_id, FicChange.run_id)
+    )
+
+    with engine.connect() as conn:
+        return [dict(row._mapping) for row in conn.execute(stmt)]
+
+
+def get_latest_run():
+    """Returns the ID of the last scrape, or 0 if there hasn't been one."""
+
+    with engine.connect() as conn:
+        return conn.execute(select(db.func.max(Run.id))).scalar() or 0
 
 
 def delete_fic(fic_id):
-    """Deletes a fic from the database."""
+    """Deletes a fic from the database, and from the scrapes that haven't checked it yet."""
 
     with Session() as session:
         query = session.get(Fanfic, fic_id)
         session.delete(query)
+        session.execute(delete(FicFandom).where(FicFandom.fic_id == fic_id))
+        session.execute(delete(PendingFic).where(PendingFic.fic_id == fic_id))
         session.commit()
 
 def get_fic(fic_id):
@@ -80,23 +313,126 @@ def get_fic(fic_id):
 
     with Session() as session:
         query = session.get(Fanfic, fic_id)
-        result_dict = FanficSchema().dump(query)
+        result_dict = get_fanfic_schema()().dump(query)
         return result_dict
 
 
-def get_all_fics():
-    """Returns all fics from the database."""
+def select_fics(columns=None, filters=None, sort=None, search=None):
+    """Returns a select of every fic. If columns is given, only those columns (and 'id') are selected.
+    filters (see filter_clauses) limits it to the fics that match every filter, and sort (one of SORT_COLUMNS) orders
+    it by that column, highest or newest first. Otherwise fics are in the order they were added.
+    search (an FTS5 query) limits it to the fics that match it, best matches first unless sort is given."""
 
-    with Session() as session:
-        query = session.query(Fanfic)
-        result_dict = [FanficSchema().dump(u) for u in query.all()]
-        return result_dict
+    table = Fanfic.__table__
+    if columns is None:
+        selected = select(table)
+    else:
+        selected = select(*[table.c.id] + [table.c[column] for column in columns if column != 'id'])
+
+    if search is not None:
+        if sort is None:
+            selected = selected.join_from(table, fics_fts, fics_fts.c.rowid == table.c.id).where(search_clause(search)).order_by(fics_fts.c.rank)
+        else:
+            # Sorted by a column, fics are read from its index and kept if they match, so the matches aren't all sorted.
+            # (id + 0 stops SQLite from looking up each match by id instead, and then sorting all of them)
+            matches = select(fics_fts.c.rowid).where(search_clause(search))
+            selected = selected.where((table.c.id + 0).in_(matches))
+
+    if filters:
+        selected = selected.where(*filter_clauses(filters))
+
+        # Fics updated recently are listed newest first, so they are read from ix_fics_date_updated. In id order, SQLite
+        # would scan every fic instead, as it has no way to tell how few fics the date range holds.
+        if sort is None and search is None and ('updated_since' in filters or filters.get('stale') is False):
+            sort = 'date_updated'
+
+    # Ties are broken by id in the same direction, so SQLite can read the rows straight from the column's index.
+    if sort is not None:
+        return selected.order_by(table.c[sort].desc(), table.c.id.desc())
+
+    # id is the rowid, so ordering by it is free. Without an ORDER BY, SQLite may read through an index in a different order.
+    return selected.order_by(table.c.id)
+
+
+def search_clause(search):
+    return fics_fts.c.fics_fts.op('MATCH')(search)
+
+
+def count_matches(search, limit=None):
+    """Returns how many fics match search, counting up to limit. Raises SearchError if search isn't a valid FTS5 query."""
+
+    matches = select(fics_fts.c.rowid).where(search_clause(search)).limit(limit).subquery()
+
+    with engine.connect() as conn:
+        try:
+            return conn.execute(select(db.func.count()).select_from(matches)).scalar()
+        except OperationalError as e:
+            raise SearchError(f"Can't search for {search!r}: {e.orig}")
+
+
+def filter_clauses(filters):
+    """Turns a dict of --list filters into WHERE clauses. Every filter can be answered from an index:
+    - fandom: fics with a fandom that starts with this (ignoring case)
+    - status: fics whose status is this (ignoring case)
+    - complete: True or False
+    - stale: True for fics not updated in STALE_THRESHOLD days, False for the others (including fics not scraped yet)
+    - updated_since: fics updated on or after this datetime"""
+
+    table = Fanfic.__table__
+    clauses = []
+
+    if 'fandom' in filters:
+        # A range instead of LIKE, so the NOCASE index on fandom is always used
+        prefix = filters['fandom']
+        matching = select(FicFandom.fic_id).where(FicFandom.fandom >= prefix, FicFandom.fandom < prefix + "\U0010ffff")
+        clauses.append(table.c.id.in_(matching))
+
+    if 'status' in filters:
+        clauses.append(table.c.status.collate('NOCASE') == filters['status'])
+
+    if 'complete' in filters:
+        clauses.append(table.c.complete == filters['complete'])
+
+    if 'stale' in filters:
+        # The same cutoff as is_stale() in __main__.py: more than STALE_THRESHOLD whole days since the update.
+        # Like is_stale(), fics that haven't been scraped yet aren't stale.
+        cutoff = constants.NOW - timedelta(days=constants.STALE_THRESHOLD + 1)
+        if filters['stale']:
+            clauses.append(table.c.date_updated <= cutoff)
+        else:
+            clauses.append(db.or_(table.c.date_updated > cutoff, table.c.date_updated.is_(None)))
+
+    if 'updated_since' in filters:
+        clauses.append(table.c.date_updated >= filters['updated_since'])
+
+    return clauses
+
+
+def get_all_fics(columns=None):
+    """Returns all fics from the database. If columns is given, only those columns (and 'id') are read."""
+
+    # Rows are read with a plain select instead of through FanficSchema, which is slow on large databases.
+    with engine.connect() as conn:
+        result = conn.execute(select_fics(columns))
+        return [dict(row._mapping) for row in result]
+
+
+def iter_fics(columns=None, chunk_size=100, limit=None, offset=0, filters=None, sort=None, search=None):
+    """Yields fics from the database in lists of chunk_size. Each chunk is only read from the database when it is needed.
+    filters, sort and search are passed to select_fics."""
+
+    stmt = select_fics(columns, filters, sort, search).limit(limit).offset(offset)
+
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True).execute(stmt)
+        for chunk in result.partitions(chunk_size):
+            yield [dict(row._mapping) for row in chunk]
 
 
 def get_fic_ids():
     """Returns all fic IDs from the database in a list."""
 
     with Session() as session:
-        query = session.query(Fanfic.id).all()
+        query = session.query(Fanfic.id).order_by(Fanfic.id).all()
         result = [r for r, in query]
         return result
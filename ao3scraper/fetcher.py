@@ -0,0 +1,338 @@
+# This module fetches a work's metadata from AO3 without downloading or parsing every chapter body.
+
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import re
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import AO3
+import requests
+from requests.adapters import HTTPAdapter
+from bs4 import BeautifulSoup, SoupStrainer
+
+# Custom modules
+import circuit_breaker
+import constants
+import http_cache
+import metrics
+import rate_limiter
+
+WORK_URL = constants.AO3_URL + "/works/{}?view_adult=true"
+
+# Only these parts of a work page hold the fields listed in constants.TABLE_COLUMNS:
+# - "work navigation actions" holds the chapter index and the download links (used for date_edited).
+# - "work meta group" holds the tags, dates and stats.
+# - "preface group" holds the title, authors, summary and restricted icon.
+# Everything else (including the chapter text) is skipped by the parser.
+METADATA_STRAINER = SoupStrainer(attrs={"class": ["work navigation actions", "work meta group", "preface group"]})
+
+# Chapter index entries look like "12. Chapter title"
+CHAPTER_NUMBER = re.compile(r"^\d+\.\s*")
+
+REQUEST_TIMEOUT = 30
+
+# Returned instead of metadata when a page hasn't changed since it was last scraped.
+UNCHANGED = object()
+
+
+def create_session():
+    """Creates a keep-alive HTTP session whose connection pool is shared by every worker."""
+
+    session = requests.Session()
+
+    # pool_block makes workers wait for a free connection instead of opening more than the per-host cap.
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=constants.MAX_CONNECTIONS_PER_HOST, pool_block=True)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    return session
+
+
+def fetch_all(work_ids, on_result, digests=None):
+    """Fetches every work in work_ids, calling on_result(work_id, result) as each one finishes.
+    result is either the work's row (see fetch_metadata), the exception raised while fetching it, or UNCHANGED.
+    digests maps the IDs of the works already in the database to their saved metadata_digest (or None).
+    Only those works can be UNCHANGED.
+    Returns the HTTP cache's hit and miss counts, or None if the cache is disabled.
+    Raises CircuitOpenError if AO3 went down; on_result isn't called for the works that weren't fetched."""
+
+    return asyncio.run(_fetch_all(work_ids, on_result, digests or {}))
+
+
+async def _fetch_all(work_ids, on_result, digests):
+    loop = asyncio.get_running_loop()
+    work_ids = iter(work_ids)
+
+    # Every worker shares one limiter, so the combined request rate stays within the configured limits.
+    limiter = rate_limiter.create_limiter()
+
+    # If AO3 goes down, the breaker stops every worker, and gives up after circuit_max_trips failed probes.
+    breaker = circuit_breaker.create_breaker(constants.CIRCUIT_MAX_TRIPS)
+    outage = None
+
+    # An http_cache_size of 0 disables the cache.
+    cache = http_cache.ResponseCache() if constants.HTTP_CACHE_SIZE else None
+
+    # Parsing is CPU-bound, so with more than one process it is moved out of this process, where it would hold the GIL.
+    # Fetching stays here, so every request still goes through the same session and rate limiter.
+    parser = None
+    parse = parse_page
+    if constants.PROCESSES > 1:
+        # spawn is used because this process already has threads running, which fork doesn't copy safely.
+        parser = ProcessPoolExecutor(max_workers=constants.PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+
+        def parse(work_id, content):
+            return parser.submit(parse_page, work_id, content).result()
+
+    session = create_session()
+    executor = ThreadPoolExecutor(max_workers=constants.CONCURRENCY)
+
+    try:
+        # Each worker pulls the next ID until none are left, so at most CONCURRENCY requests are in flight.
+        async def worker():
+            nonlocal outage
+            for work_id in work_ids:
+                try:
+                    result = await loop.run_in_executor(executor, fetch_metadata, work_id, session, limiter, cache,
+                                                        work_id in digests, parse, breaker, digests.get(work_id))
+                except circuit_breaker.CircuitOpenError as e:
+                    # This work wasn't fetched, so it isn't reported, and the worker stops taking new ones.
+                    outage = e
+                    return
+                except Exception as e:
+                    result = e
+                on_result(work_id, result)
+
+        await asyncio.gather(*(worker() for _ in range(constants.CONCURRENCY)))
+    finally:
+        # If the scrape was interrupted (e.g. with Ctrl-C), threads waiting out a backoff or the breaker's cooldown are
+        # woken and stop, and works that haven't started are dropped, so the executor doesn't wait for all of them.
+        # Only requests already being sent are waited for.
+        limiter.close()
+        breaker.close()
+        executor.shutdown(cancel_futures=True)
+        session.close()
+
+        if cache is not None:
+            cache.close()
+        if parser is not None:
+            parser.shutdown()
+
+    if outage is not None:
+        raise outage
+
+    return cache.stats if cache is not None else None
+
+
+def fetch_metadata(work_id, session=requests, limiter=None, cache=None, known=False, parse=None, breaker=None, saved_digest=None):
+    """Fetches a work's page and returns its metadata as a row for the database (see to_row), with its metadata_digest.
+    If known is True, UNCHANGED is returned instead when the page is the same as the one in cache (without parsing it),
+    or when the metadata's digest is saved_digest.
+    parse(work_id, content) is used to parse the page, and defaults to parse_page.
+    If breaker (a CircuitBreaker) is given, every request goes through it."""
+
+    if parse is None:
+        parse = parse_page
+
+    if cache is None:
+        # Without view_full_work AO3 only serves the first chapter, instead of the entire work.
+        response = request_page(WORK_URL.format(work_id), session, limiter, breaker=breaker)
+        check_status(response)
+        content = response.content
+    else:
+        # Send the cached page's validators, so AO3 can reply with 304 Not Modified instead of the whole page.
+        cached = cache.get(work_id)
+        response = request_page(WORK_URL.format(work_id), session, limiter, http_cache.conditional_headers(cached), breaker)
+
+        if response.status_code == 304 and cached is not None:
+            cache.record(hit=True, not_modified=True)
+            if known:
+                metrics.count('unchanged', 'page')
+                return UNCHANGED
+            content = cached.body
+        else:
+            check_status(response)
+
+            # AO3 doesn't always send validators, so the page is also compared with the cached one by hash.
+            digest = http_cache.page_digest(response.content)
+            unchanged = cached is not None and cached.digest == digest
+            cache.record(hit=unchanged)
+
+            if unchanged and known:
+                # The cached page parsed, so this one does too. Only its validators are updated.
+                cache.put(work_id, response, digest)
+                metrics.count('unchanged', 'page')
+                return UNCHANGED
+            content = response.content
+
+    with metrics.timer('parse'):
+        row = to_row(parse(work_id, content))
+
+    # Pages are only cached once they have parsed. Otherwise a page that stopped parsing (e.g. a work that became
+    # restricted) would fail once, and then come back as UNCHANGED with its old metadata on every later scrape.
+    if cache is not None and response.status_code != 304:
+        cache.put(work_id, response, digest)
+
+    # Pages change more often than what is saved from them (and the page cache may have evicted the old page),
+    # so the parsed metadata is compared with the saved one too.
+    row['metadata_digest'] = metadata_digest(row)
+    if known and row['metadata_digest'] == saved_digest:
+        metrics.count('unchanged', 'metadata')
+        return UNCHANGED
+
+    return row
+
+
+def request_page(url, session=requests, limiter=None, headers=None, breaker=None):
+    """Requests a page, retrying throttled (429), 5xx and dropped requests with backoff.
+    If breaker is given, each attempt waits while it is open, and its outcome is reported to it."""
+
+    if limiter is None:
+        limiter = rate_limiter.create_limiter()
+
+    for attempt in range(constants.MAX_RETRIES + 1):
+        limiter.acquire()
+
+        # The breaker is checked last, right before sending. A worker that passed it and then waited in the limiter
+        # (which slows down during an outage) would otherwise send its request after the breaker had opened.
+        if breaker is not None:
+            ticket = breaker.acquire()
+
+        start = time.perf_counter()
+        try:
+            response = session.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+        except (requests.Timeout, requests.ConnectionError) as e:
+            metrics.count('requests')
+            if breaker is not None:
+                breaker.failure(ticket)
+            if attempt == constants.MAX_RETRIES:
+                raise
+            metrics.count('retries', type(e).__name__)
+            limiter.failure()
+            limiter.sleep(rate_limiter.backoff(attempt))
+            continue
+        except BaseException:
+            # Anything else doesn't say whether AO3 is up, but the breaker has to know the request is over.
+            if breaker is not None:
+                breaker.release(ticket)
+            raise
+
+        record_request(response, time.perf_counter() - start)
+
+        if breaker is not None:
+            if response.status_code in circuit_breaker.FAILURE_STATUSES:
+                breaker.failure(ticket)
+            else:
+                breaker.success(ticket)
+
+        if response.status_code not in rate_limiter.RETRY_STATUSES or attempt == constants.MAX_RETRIES:
+            break
+
+        metrics.count('retries', f"HTTP {response.status_code}")
+
+        # Retry-After pauses every worker, not just this one. Without it, only this worker backs off.
+        retry_after = rate_limiter.parse_retry_after(response.headers.get("Retry-After"))
+        limiter.failure(retry_after)
+        limiter.sleep(retry_after if retry_after is not None else rate_limiter.backoff(attempt))
+
+    if response.status_code in rate_limiter.RETRY_STATUSES:
+        limiter.failure()
+    else:
+        limiter.success()
+
+    return response
+
+
+def record_request(response, seconds):
+    """Records a request's timings and size.
+    requests doesn't time DNS lookups and connecting separately, so they are part of the time to first byte."""
+
+    # elapsed stops when the headers have been read. The rest of the request is spent downloading the body.
+    ttfb = response.elapsed.total_seconds()
+    metrics.observe('request', seconds)
+    metrics.observe('ttfb', ttfb)
+    metrics.observe('download', max(0.0, seconds - ttfb))
+
+    metrics.count('requests')
+    metrics.count('responses', f"HTTP {response.status_code}")
+    metrics.count('bytes', amount=len(response.content))
+
+
+def check_status(response):
+    """Raises the same errors as ao3_api for responses that aren't a work page."""
+
+    if response.status_code == 404:
+        raise AO3.utils.InvalidIdError("Cannot find work")
+    if response.status_code == 429:
+        raise AO3.utils.HTTPError("We are being rate-limited. Try again in a while or reduce the number of requests")
+    if response.status_code >= 500:
+        raise AO3.utils.HTTPError(f"AO3 returned an error (HTTP {response.status_code})")
+
+
+def parse_page(work_id, content):
+    """Parses the metadata out of a work page. It only uses its arguments, so it can run in another process."""
+
+    # Setup custom warning format
+    def custom_formatwarning(msg, *args, **kwargs):
+        if constants.WARNINGS:
+            return f"(Work: {work_id}) Warning: {str(msg)}\n"
+        return ""
+
+    warnings.formatwarning = custom_formatwarning
+
+    soup = BeautifulSoup(content, "lxml", parse_only=METADATA_STRAINER)
+
+    # Restricted works redirect guests to the login page, which has no metadata block.
+    if soup.find("dl", {"class": "work meta group"}) is None:
+        raise AttributeError("Work page has no metadata")
+
+    # Reuse ao3_api's field parsers on the partial page.
+    work = AO3.Work(work_id, load=False)
+    work._soup = soup
+
+    metadata = work.metadata
+    metadata['chapter_titles'] = get_chapter_titles(soup, metadata['title'])
+
+    # ao3_api turns dates into strings, but the database stores them as datetimes. They are already parsed, so reuse them.
+    for column in constants.DATE_COLUMNS:
+        if column in metadata:
+            metadata[column] = getattr(work, column)
+
+    return metadata
+
+
+def to_row(metadata):
+    """Turns metadata into a row for the database."""
+
+    for value in metadata:
+        # If type of entry is list, store it as comma-seperated string (e.g. "foo, bar").
+        if type(metadata[value]) is list:
+            metadata[value] = ", ".join(metadata[value])
+
+    # Strip leading and trailing whitespace from fic summaries.
+    metadata['summary'] = metadata['summary'].strip()
+
+    return metadata
+
+
+def metadata_digest(row):
+    """Returns a hash of every value in a row that is saved in the database."""
+
+    values = {column: value for column, value in row.items() if column not in ('id', 'metadata_digest')}
+    return hashlib.sha256(json.dumps(values, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def get_chapter_titles(soup, work_title):
+    """Returns the title of every chapter, read from the chapter index rather than the chapters themselves."""
+
+    select = soup.find("select", {"id": "selected_id"})
+
+    # Oneshots have no chapter index. ao3_api uses the work's title as the chapter title for these.
+    if select is None:
+        return [work_title]
+
+    return [CHAPTER_NUMBER.sub("", option.get_text().strip()) for option in select.find_all("option")]
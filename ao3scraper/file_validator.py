@@ -4,11 +4,8 @@ import sqlite3
 from os import path
 import pathlib
 #from yaml import dump, Dumper
-from ruamel.yaml import YAML
 
 from sqlite3 import OperationalError
-from alembic.config import Config
-from alembic import command
 import uuid
 from shutil import copy
 
@@ -16,8 +13,14 @@ from shutil import copy
 import constants
 
 def main():
+    check_config()
+    check_database()
+
+def check_config():
     # Create config file if config file does not exist
     if not path.exists(constants.CONFIG_FILE_PATH):
+        from ruamel.yaml import YAML
+
         print("No config file found. Creating new config file...")
 
         pathlib.Path(constants.CONFIG_PATH).mkdir(parents=True, exist_ok=True)
@@ -35,6 +38,7 @@ def main():
         print("Config file created.")
         print("You can change configuration options in config.yaml")
 
+def check_database():
     # Create database file if database does not exist
     if not path.exists(constants.DATABASE_FILE_PATH):
         print("No database found. Creating new database...")
@@ -46,9 +50,32 @@ def main():
         cursor = connection.cursor()
 
         # Create fics table
-        cursor.execute("CREATE TABLE fics (id INTEGER)")
-        for column in constants.TABLE_COLUMNS:
-            cursor.execute(f"ALTER TABLE fics ADD {column} TEXT")
+        columns = ", ".join(f"{column} {column_type(column)}" for column in constants.TABLE_COLUMNS)
+        cursor.execute(f"CREATE TABLE fics (id INTEGER NOT NULL PRIMARY KEY, {columns}, "
+                       "last_checked DATETIME, times_checked INTEGER DEFAULT 0, times_changed INTEGER DEFAULT 0, metadata_digest TEXT)")
+
+        # Create indexes used to sort and filter fics
+        cursor.execute("CREATE INDEX ix_fics_date_updated ON fics (date_updated)")
+        cursor.execute("CREATE INDEX ix_fics_complete ON fics (complete)")
+        cursor.execute("CREATE INDEX ix_fics_status ON fics (status COLLATE NOCASE)")
+        cursor.execute("CREATE INDEX ix_fics_kudos ON fics (kudos)")
+        cursor.execute("CREATE INDEX ix_fics_words ON fics (words)")
+
+        # Create the fandom lookup table used by --list --where fandom=...
+        cursor.execute("CREATE TABLE fic_fandoms (fic_id INTEGER NOT NULL, fandom TEXT NOT NULL COLLATE NOCASE, "
+                       "PRIMARY KEY (fic_id, fandom)) WITHOUT ROWID")
+        cursor.execute("CREATE INDEX ix_fic_fandoms_fandom ON fic_fandoms (fandom)")
+
+        # Create the full-text index used by --search, and the triggers that keep it in step with fics
+        create_search_index(cursor)
+
+        # Create scrape history tables
+        cursor.execute("CREATE TABLE runs (id INTEGER NOT NULL PRIMARY KEY, started DATETIME, finished DATETIME, shard TEXT)")
+        cursor.execute("CREATE TABLE fic_history (run_id INTEGER NOT NULL, fic_id INTEGER NOT NULL, "
+                       "kudos INTEGER, hits INTEGER, words INTEGER, nchapters INTEGER, status TEXT, "
+                       "PRIMARY KEY (run_id, fic_id)) WITHOUT ROWID")
+        cursor.execute("CREATE TABLE pending_fics (run_id INTEGER NOT NULL, fic_id INTEGER NOT NULL, "
+                       "PRIMARY KEY (run_id, fic_id)) WITHOUT ROWID")
 
         # Create metadata table
         cursor.execute("CREATE TABLE alembic_version (version_num VARCHAR(32) NOT NULL, CONSTRAINT alembic_version_pkc PRIMARY KEY (version_num));")
@@ -62,6 +89,34 @@ def main():
 
     validate_database()
 
+def create_search_index(cursor):
+    # An external content FTS5 table only stores the index, and reads the text itself from fics.
+    columns = ", ".join(constants.SEARCH_COLUMNS)
+    old_values = ", ".join(f"old.{column}" for column in constants.SEARCH_COLUMNS)
+    new_values = ", ".join(f"new.{column}" for column in constants.SEARCH_COLUMNS)
+
+    # prefix indexes the first 2 and 3 characters of every term too, so prefix queries (e.g. "drac*") don't have to
+    # read every term that starts with them.
+    cursor.execute(f"CREATE VIRTUAL TABLE fics_fts USING fts5({columns}, content='fics', content_rowid='id', prefix='2 3')")
+    cursor.execute(f"CREATE TRIGGER fics_fts_insert AFTER INSERT ON fics BEGIN "
+                   f"INSERT INTO fics_fts (rowid, {columns}) VALUES (new.id, {new_values}); END")
+    cursor.execute(f"CREATE TRIGGER fics_fts_delete AFTER DELETE ON fics BEGIN "
+                   f"INSERT INTO fics_fts (fics_fts, rowid, {columns}) VALUES ('delete', old.id, {old_values}); END")
+    # Only updates that change an indexed column touch the index, so recording a check doesn't.
+    cursor.execute(f"CREATE TRIGGER fics_fts_update AFTER UPDATE OF {columns} ON fics BEGIN "
+                   f"INSERT INTO fics_fts (fics_fts, rowid, {columns}) VALUES ('delete', old.id, {old_values}); "
+                   f"INSERT INTO fics_fts (rowid, {columns}) VALUES (new.id, {new_values}); END")
+
+def column_type(column):
+    # Returns the SQLite type of a column in TABLE_COLUMNS
+    if column in constants.INTEGER_COLUMNS:
+        return "INTEGER"
+    if column in constants.BOOLEAN_COLUMNS:
+        return "BOOLEAN"
+    if column in constants.DATE_COLUMNS:
+        return "DATETIME"
+    return "TEXT"
+
 def validate_database():
     # A new database has NOT been created, so we must validate the existing one.
     # Connect to database
@@ -96,6 +151,10 @@ def upgrade_database():
         print(f"Saving backup of current database to {backup_db_path}")
         copy(constants.DATABASE_FILE_PATH, backup_db_path)
 
+        # Alembic is slow to import, so it is only imported when a migration is needed.
+        from alembic.config import Config
+        from alembic import command
+
         alembic_cfg = Config("alembic.ini")
         command.upgrade(alembic_cfg, constants.ALEMBIC_VERSION)
         quit()
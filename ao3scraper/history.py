@@ -0,0 +1,42 @@
+# This module works out what changed about a fic between two scrapes, so that the changes can be kept after the fic is overwritten.
+
+from dictdiffer import diff
+
+# The columns whose changes are recorded. Numbers are stored as the difference from the last scrape, and status as its new value.
+TRACKED_COLUMNS = ['kudos', 'hits', 'words', 'nchapters', 'status']
+NUMBER_COLUMNS = ['kudos', 'hits', 'words', 'nchapters']
+
+
+def get_changes(old_fic, new_fic):
+    """Returns a dict with the changes between two versions of a fic, or None if none of TRACKED_COLUMNS changed."""
+
+    old = {column: old_fic.get(column) for column in TRACKED_COLUMNS}
+    new = {column: new_fic.get(column) for column in TRACKED_COLUMNS}
+
+    changes = {}
+    for kind, column, (old_value, new_value) in diff(old, new):
+        if column in NUMBER_COLUMNS:
+            changes[column] = (new_value or 0) - (old_value or 0)
+        else:
+            changes[column] = new_value
+
+    return changes or None
+
+
+def combine_changes(rows):
+    """Combines the changes of several runs into one dict per fic. rows must be ordered by run."""
+
+    combined = {}
+    for row in rows:
+        fic = combined.setdefault(row['fic_id'], {'fic_id': row['fic_id'], 'title': row['title'], 'runs': 0})
+        fic['runs'] += 1
+
+        for column in NUMBER_COLUMNS:
+            if row[column] is not None:
+                fic[column] = fic.get(column, 0) + row[column]
+
+        # Only the latest status is kept.
+        if row['status'] is not None:
+            fic['status'] = row['status']
+
+    return list(combined.values())
@@ -0,0 +1,120 @@
+# This module keeps the last response for each work page on disk, so that pages which haven't changed since the last scrape don't need to be parsed again.
+
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from collections import namedtuple
+
+# Custom modules
+import constants
+
+CACHE_FILE_PATH = constants.DATA_PATH + "http_cache.db"
+
+CachedResponse = namedtuple("CachedResponse", ["etag", "last_modified", "digest", "body"])
+
+# AO3 puts a new CSRF token on every page it serves, so it is removed before a page is hashed.
+CSRF_TOKEN = re.compile(rb'(name="csrf-token" content|name="authenticity_token" value)="[^"]*"')
+
+
+class ResponseCache:
+    """A size-capped cache of work pages, keyed by work ID. The least recently used pages are evicted first.
+    It is shared by every fetch worker, so each method holds a lock while it uses the connection."""
+
+    def __init__(self, path=CACHE_FILE_PATH, max_size=None):
+        if max_size is None:
+            max_size = constants.HTTP_CACHE_SIZE * 1024 * 1024
+
+        self.max_size = max_size
+        self.stats = {'hits': 0, 'misses': 0, 'not_modified': 0}
+        self.lock = threading.Lock()
+
+        # Every statement is committed as soon as it runs (isolation_level=None). Otherwise sqlite3 would keep a write
+        # transaction open from the first write until the cache is trimmed, and every other scrape, shard or daemon
+        # using the cache would get "database is locked" until then.
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS responses (work_id INTEGER NOT NULL PRIMARY KEY, "
+                                "etag TEXT, last_modified TEXT, digest TEXT, body BLOB, size INTEGER, last_used REAL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS ix_responses_last_used ON responses (last_used)")
+
+    def get(self, work_id):
+        """Returns the cached response for a work, or None if there isn't one."""
+
+        with self.lock:
+            row = self.connection.execute("SELECT etag, last_modified, digest, body FROM responses WHERE work_id = ?", (work_id,)).fetchone()
+            if row is None:
+                return None
+
+            self.connection.execute("UPDATE responses SET last_used = ? WHERE work_id = ?", (time.time(), work_id))
+
+        etag, last_modified, digest, body = row
+        return CachedResponse(etag, last_modified, digest, zlib.decompress(body))
+
+    def put(self, work_id, response, digest):
+        """Caches a response. Bodies are stored compressed."""
+
+        body = zlib.compress(response.content)
+
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (work_id, response.headers.get("ETag"), response.headers.get("Last-Modified"), digest, body, len(body), time.time())
+            )
+
+    def record(self, hit, not_modified=False):
+        """Counts a cache hit (the page hadn't changed) or miss."""
+
+        with self.lock:
+            self.stats['hits' if hit else 'misses'] += 1
+            if not_modified:
+                self.stats['not_modified'] += 1
+
+    def close(self):
+        """Trims the cache and closes it."""
+
+        self.trim()
+        with self.lock:
+            self.connection.close()
+
+    def trim(self):
+        """Evicts the least recently used pages until the cache fits in max_size."""
+
+        with self.lock:
+            total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+            if total > self.max_size:
+                rows = self.connection.execute("SELECT work_id, size FROM responses ORDER BY last_used")
+                evicted = []
+                for work_id, size in rows:
+                    if total <= self.max_size:
+                        break
+                    evicted.append((work_id,))
+                    total -= size
+                rows.close()
+
+                # The evicted pages are deleted in one transaction, rather than committing after each of them.
+                with self.connection:
+                    self.connection.execute("BEGIN")
+                    self.connection.executemany("DELETE FROM responses WHERE work_id = ?", evicted)
+
+
+def conditional_headers(cached):
+    """Returns the headers that ask AO3 to reply with 304 Not Modified if the page hasn't changed."""
+
+    headers = {}
+    if cached is not None:
+        if cached.etag:
+            headers["If-None-Match"] = cached.etag
+        if cached.last_modified:
+            headers["If-Modified-Since"] = cached.last_modified
+    return headers
+
+
+def page_digest(content):
+    """Returns a hash of a page, ignoring the parts that change on every request."""
+
+    return hashlib.sha256(CSRF_TOKEN.sub(b"", content)).hexdigest()
@@ -0,0 +1,168 @@
+# This module records where the time in a scrape goes (requests, parsing, database writes and rendering), and saves a summary of each run.
+
+import json
+import pathlib
+import threading
+import time
+from contextlib import contextmanager
+
+# Custom modules
+import constants
+
+METRICS_PATH = constants.DATA_PATH + "metrics/"
+
+# Upper bounds (in seconds) of the histogram buckets. The last bucket holds everything slower.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float('inf'))
+
+
+class Histogram:
+    """Counts how many observations fell into each of BUCKETS, and their sum."""
+
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        for position, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.buckets[position] += 1
+                break
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Returns the upper bound of the bucket the q-th quantile falls into."""
+
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.buckets):
+            seen += count
+            if seen >= target:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'mean': round(self.sum / self.count, 6) if self.count else 0,
+            'p50': round(self.quantile(0.5), 6),
+            'p95': round(self.quantile(0.95), 6),
+            'max': round(self.max, 6),
+        }
+
+
+# Every fetch worker records into the same histograms and counters, so they are only changed while holding the lock.
+lock = threading.Lock()
+histograms = {}
+counters = {}
+
+
+def reset():
+    """Forgets everything recorded so far."""
+
+    with lock:
+        histograms.clear()
+        counters.clear()
+
+
+def observe(name, seconds):
+    """Records how long something took."""
+
+    with lock:
+        histograms.setdefault(name, Histogram()).observe(seconds)
+
+
+def count(name, label=None, amount=1):
+    """Adds amount to a counter. label splits a counter by type, e.g. errors by exception."""
+
+    with lock:
+        key = (name, label)
+        counters[key] = counters.get(key, 0) + amount
+
+
+@contextmanager
+def timer(name):
+    """Records how long the body of a with statement takes."""
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+
+def summary():
+    """Returns every histogram and counter as a dict, along with the request rate and throughput of the fetch phase."""
+
+    with lock:
+        result = {
+            'timings': {name: histogram.summary() for name, histogram in sorted(histograms.items())},
+            'counters': {},
+        }
+
+        for (name, label), value in sorted(counters.items(), key=lambda item: (item[0][0], str(item[0][1]))):
+            if label is None:
+                result['counters'][name] = value
+            else:
+                result['counters'].setdefault(name, {})[label] = value
+
+        fetch_time = histograms['fetch'].sum if 'fetch' in histograms else 0
+
+    if fetch_time:
+        result['requests_per_second'] = round(result['counters'].get('requests', 0) / fetch_time, 3)
+        result['bytes_per_second'] = round(result['counters'].get('bytes', 0) / fetch_time, 1)
+
+    return result
+
+
+def write_json(run_id):
+    """Saves the summary of a run to METRICS_PATH/run-<run_id>.json, and returns the file's path."""
+
+    pathlib.Path(METRICS_PATH).mkdir(parents=True, exist_ok=True)
+    file_path = f"{METRICS_PATH}run-{run_id}.json"
+
+    data = {'run': run_id, 'started': constants.NOW.strftime(constants.DATE_FORMAT), **summary()}
+    with open(file_path, 'w') as file:
+        json.dump(data, file, indent=2)
+
+    return file_path
+
+
+def write_prometheus(file_path):
+    """Saves every histogram and counter in Prometheus' text format, e.g. for node_exporter's textfile collector."""
+
+    lines = []
+
+    with lock:
+        for name, histogram in sorted(histograms.items()):
+            metric = f"ao3scraper_{name}_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, value in zip(BUCKETS, histogram.buckets):
+                cumulative += value
+                le = "+Inf" if bound == float('inf') else repr(bound)
+                lines.append(f'{metric}_bucket{{le="{le}"}} {cumulative}')
+            lines.append(f"{metric}_sum {histogram.sum}")
+            lines.append(f"{metric}_count {histogram.count}")
+
+        names = sorted({name for name, label in counters})
+        for name in names:
+            metric = f"ao3scraper_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            for (counter_name, label), value in sorted(counters.items(), key=lambda item: str(item[0][1])):
+                if counter_name != name:
+                    continue
+                if label is None:
+                    lines.append(f"{metric} {value}")
+                else:
+                    lines.append(f'{metric}{{type="{label}"}} {value}')
+
+    # Written to a temporary file first, so a collector never reads a half-written file.
+    temp_path = file_path + ".tmp"
+    with open(temp_path, 'w') as file:
+        file.write("\n".join(lines) + "\n")
+    pathlib.Path(temp_path).replace(file_path)
@@ -0,0 +1,70 @@
+# This module writes fics as JSON Lines or CSV, for --format. Rows are written as they come, without building a rich table.
+
+import csv
+import json
+from datetime import datetime
+
+# Custom modules
+import constants
+
+# updated and stale replace the UPDATED_STYLES and STALE_STYLES row styles of the table.
+FIELDS = ['id'] + constants.TABLE_COLUMNS + ['updated', 'new_chapters', 'stale', 'error']
+
+
+def create_writer(format, file):
+    """Returns a writer for format ('jsonl' or 'csv') that writes to file."""
+
+    if format == 'jsonl':
+        return JsonLinesWriter(file)
+    if format == 'csv':
+        return CsvWriter(file)
+    raise ValueError(f"{format} is not a machine-readable format")
+
+
+def to_row(fic, flags):
+    """Combines a fic with its snapshot-style flags ($updated, $stale and $error) into one dict with every field in FIELDS."""
+
+    row = {column: fic.get(column) for column in FIELDS[:-4]}
+    row['updated'] = bool(flags.get('$updated'))
+    row['new_chapters'] = flags.get('$updated') or 0
+    row['stale'] = bool(flags.get('$stale'))
+    row['error'] = flags.get('$error')
+    return row
+
+
+def format_value(value):
+    if isinstance(value, datetime):
+        return value.strftime(constants.DATE_FORMAT)
+    raise TypeError(f"{type(value).__name__} can't be written")
+
+
+class JsonLinesWriter:
+    """Writes each fic as a JSON object on its own line."""
+
+    def __init__(self, file):
+        self.file = file
+
+    def write(self, fic, flags):
+        self.file.write(json.dumps(to_row(fic, flags), default=format_value) + "\n")
+
+    def close(self):
+        self.file.flush()
+
+
+class CsvWriter:
+    """Writes fics as CSV, with a header row of FIELDS. Missing values are left empty."""
+
+    def __init__(self, file):
+        self.file = file
+        self.writer = csv.DictWriter(file, fieldnames=FIELDS)
+        self.writer.writeheader()
+
+    def write(self, fic, flags):
+        row = to_row(fic, flags)
+        for column in constants.DATE_COLUMNS:
+            if row[column] is not None:
+                row[column] = format_value(row[column])
+        self.writer.writerow(row)
+
+    def close(self):
+        self.file.flush()
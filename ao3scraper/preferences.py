@@ -0,0 +1,51 @@
+# This module loads the user's preferences from config.yaml. It is imported by constants.py the first time a preference is used.
+
+from yaml import load, Loader
+
+# Custom modules
+import constants
+import file_validator
+
+# Check that config.yaml exists
+file_validator.check_config()
+
+# Load user's custom preferences from config.yaml
+with open(constants.CONFIG_FILE_PATH, 'r') as file:
+    config_file = load(file, Loader=Loader)
+
+# Load each preference as a constant variable
+MAX_ROW_LENGTH = config_file['max_row_length']
+WARNINGS = config_file['warnings']
+STALE_THRESHOLD = config_file['stale_threshold']
+STALE_STYLES = config_file['stale_styles']
+UPDATED_STYLES = config_file['updated_styles']
+TABLE_TEMPLATE = config_file['table_template']
+
+# Preferences added after 1.0.3 fall back to their defaults, so older config files keep working.
+CONCURRENCY = config_file.get('concurrency', 5)
+MAX_CONNECTIONS_PER_HOST = config_file.get('max_connections_per_host', 5)
+PROCESSES = config_file.get('processes', 1)
+HTTP_CACHE_SIZE = config_file.get('http_cache_size', 100)
+REQUESTS_PER_SECOND = config_file.get('requests_per_second', 1)
+MIN_REQUESTS_PER_SECOND = config_file.get('min_requests_per_second', 0.1)
+MAX_REQUESTS_PER_SECOND = config_file.get('max_requests_per_second', 5)
+BURST = config_file.get('burst', 5)
+MAX_RETRIES = config_file.get('max_retries', 5)
+BACKOFF_BASE = config_file.get('backoff_base', 2)
+BACKOFF_MAX = config_file.get('backoff_max', 120)
+CIRCUIT_FAILURES = config_file.get('circuit_failures', 5)
+CIRCUIT_COOLDOWN = config_file.get('circuit_cooldown', 30)
+CIRCUIT_MAX_TRIPS = config_file.get('circuit_max_trips', 3)
+SCRAPE_BUDGET = config_file.get('scrape_budget', 0)
+MIN_CHECK_INTERVAL = config_file.get('min_check_interval', 1)
+MAX_CHECK_INTERVAL = config_file.get('max_check_interval', 30)
+COMPLETE_CHECK_MULTIPLIER = config_file.get('complete_check_multiplier', 4)
+DAEMON_REQUESTS_PER_HOUR = config_file.get('daemon_requests_per_hour', 600)
+SQLITE_WAL = config_file.get('sqlite_wal', True)
+PROMETHEUS_FILE = config_file.get('prometheus_file', '')
+PAGE_SIZE = config_file.get('page_size', 50)
+
+# Check that all the columns listed in the config file are valid
+for i in TABLE_TEMPLATE:
+    if i['column'] not in constants.TABLE_COLUMNS and i['column'] not in constants.CUSTOM_COLUMNS:
+        print(f"{i['column']} is not a valid column.")
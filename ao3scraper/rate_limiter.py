@@ -0,0 +1,135 @@
+# This module limits how fast requests are sent to AO3, and adapts that limit to how AO3 responds.
+
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+# Custom modules
+import constants
+
+# Responses that mean "try again later" rather than "this work is broken"
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Additive increase / multiplicative decrease of the request rate
+RATE_INCREASE = 0.05
+RATE_DECREASE = 0.5
+
+
+class LimiterClosed(Exception):
+    """Raised by RateLimiter.acquire and RateLimiter.sleep once the limiter has been closed."""
+
+
+class RateLimiter:
+    """A token bucket shared by every worker, whose rate adapts to the error rate it observes.
+
+    Each success raises the rate a little (up to max_rate), and each throttled or failed response halves it
+    (down to min_rate), so the rate settles just under the server's limit.
+    """
+
+    def __init__(self, rate, burst, min_rate, max_rate):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._paused_until = 0
+        self._last_decrease = 0
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+
+    def acquire(self):
+        """Blocks until a request may be sent."""
+
+        while True:
+            if self._closed.is_set():
+                raise LimiterClosed("The rate limiter was closed.")
+
+            with self._lock:
+                now = time.monotonic()
+
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+
+                    wait = (1 - self._tokens) / self.rate
+
+            self.sleep(wait)
+
+    def sleep(self, seconds):
+        """Waits for seconds, unless the limiter is closed first."""
+
+        if self._closed.wait(seconds):
+            raise LimiterClosed("The rate limiter was closed.")
+
+    def close(self):
+        """Wakes every worker waiting on the limiter, and makes them raise LimiterClosed instead of sending more requests."""
+
+        self._closed.set()
+
+    def success(self):
+        """Records a successful request, and slowly raises the rate."""
+
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + RATE_INCREASE)
+
+    def failure(self, retry_after=None):
+        """Records a throttled or failed request, lowers the rate, and pauses every worker for retry_after seconds."""
+
+        with self._lock:
+            now = time.monotonic()
+
+            # Workers that were in flight at the same time report the same overload, so only decrease once per window.
+            if now - self._last_decrease > 1 / self.rate:
+                self.rate = max(self.min_rate, self.rate * RATE_DECREASE)
+                self._last_decrease = now
+
+            if retry_after is not None:
+                self._paused_until = max(self._paused_until, now + retry_after)
+                self._tokens = 0
+
+
+def create_limiter():
+    """Creates a RateLimiter from the limits in config.yaml."""
+
+    return RateLimiter(
+        rate=constants.REQUESTS_PER_SECOND,
+        burst=constants.BURST,
+        min_rate=constants.MIN_REQUESTS_PER_SECOND,
+        max_rate=constants.MAX_REQUESTS_PER_SECOND,
+    )
+
+
+def backoff(attempt):
+    """Returns how many seconds to wait before retry number attempt, using exponential backoff with full jitter."""
+
+    return random.uniform(0, min(constants.BACKOFF_MAX, constants.BACKOFF_BASE * 2 ** attempt))
+
+
+def parse_retry_after(value):
+    """Converts a Retry-After header (either seconds or an HTTP date) into seconds. Returns None if it can't be read."""
+
+    if value is None:
+        return None
+
+    if value.strip().isdigit():
+        return int(value)
+
+    try:
+        then = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    if then.tzinfo is None:
+        then = then.replace(tzinfo=timezone.utc)
+
+    return max(0, (then - datetime.now(timezone.utc)).total_seconds())
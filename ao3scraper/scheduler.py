@@ -0,0 +1,94 @@
+# This module decides which fics are due to be scraped, so that works which rarely change aren't fetched on every run.
+
+from datetime import timedelta
+
+# Custom modules
+import constants
+
+
+def check_interval(fic, now=None):
+    """Returns how many days should pass between two checks of a fic."""
+
+    if now is None:
+        now = constants.NOW
+
+    # Works updated within STALE_THRESHOLD days are checked as often as allowed. Past that, the interval grows with the work's age.
+    age = (now - fic['date_updated']).days
+    interval = constants.MIN_CHECK_INTERVAL * max(1, age / constants.STALE_THRESHOLD)
+
+    # Completed works rarely change.
+    if fic['complete']:
+        interval *= constants.COMPLETE_CHECK_MULTIPLIER
+
+    # Works that changed on most previous checks are checked more often, and works that never change less often.
+    # The +1/+2 smoothing gives works with no history a change rate of 0.5, which leaves the interval as it is.
+    change_rate = ((fic['times_changed'] or 0) + 1) / ((fic['times_checked'] or 0) + 2)
+    interval *= 0.5 / change_rate
+
+    return min(constants.MAX_CHECK_INTERVAL, max(constants.MIN_CHECK_INTERVAL, interval))
+
+
+def never_checked(fic):
+    """Returns True for fics that have never been scraped (or never checked by the scheduler)."""
+
+    return fic['title'] is None or fic['date_updated'] is None or fic['last_checked'] is None
+
+
+def priority(fic, now=None):
+    """Returns how overdue a fic is. Fics with a priority of 1 or more are due to be checked."""
+
+    if now is None:
+        now = constants.NOW
+
+    # Fics that have never been checked are always due.
+    if never_checked(fic):
+        return float('inf')
+
+    since_checked = now - fic['last_checked']
+    return (since_checked.total_seconds() / 86400) / check_interval(fic, now)
+
+
+def next_check(fic, now=None):
+    """Returns when a fic is next due to be checked."""
+
+    if now is None:
+        now = constants.NOW
+
+    if never_checked(fic):
+        return now
+
+    return fic['last_checked'] + timedelta(days=check_interval(fic, now))
+
+
+def get_due_ids(local_fics, budget=None, now=None):
+    """Returns the IDs of the fics due to be checked, most overdue first, limited to budget fics."""
+
+    if budget is None:
+        budget = constants.SCRAPE_BUDGET
+
+    scored = [(priority(fic, now), fic['id']) for fic in local_fics]
+    due = sorted((item for item in scored if item[0] >= 1), key=lambda item: item[0], reverse=True)
+
+    # A budget of 0 means there is no limit.
+    if budget:
+        due = due[:budget]
+
+    return [fic_id for score, fic_id in due]
+
+
+def record_check(local_fic, fic, now=None):
+    """Adds last_checked, times_checked and times_changed to a freshly scraped fic, so the scheduler can learn how often it changes.
+    If fic only has an 'id' (its page hadn't changed), only the check itself is recorded."""
+
+    if now is None:
+        now = constants.NOW
+
+    fic['last_checked'] = now
+    fic['times_checked'] = (local_fic['times_checked'] or 0) + 1
+
+    if 'date_updated' in fic:
+        fic['times_changed'] = local_fic['times_changed'] or 0
+        if local_fic['date_updated'] is not None and (fic['date_updated'] != local_fic['date_updated'] or fic['nchapters'] != local_fic['nchapters']):
+            fic['times_changed'] += 1
+
+    return fic
@@ -0,0 +1,89 @@
+# This module saves the results of the last scrape, so that --cache can show them again without scraping.
+
+"""
+The snapshot is a text file with one JSON document per line:
+- The first line is a header with the snapshot's version, when it was created, and the names of the columns.
+- Every other line is one fic, stored as a list of values in the same order as the columns.
+Because each fic is on its own line, the file can be read one fic at a time, and only the columns that are needed are kept.
+"""
+
+import json
+import mmap
+import os
+import tempfile
+from datetime import datetime
+
+# Custom modules
+import constants
+
+# Increase this whenever the columns or the meaning of a value change, so that old snapshots aren't misread.
+SNAPSHOT_VERSION = 2
+SNAPSHOT_FILE_PATH = constants.DATA_PATH + "results.snapshot"
+
+COLUMNS = ['id'] + constants.TABLE_COLUMNS
+
+# $updated is the number of new chapters, $stale is whether the fic was stale, and $error is the error raised while scraping it.
+FLAGS = ['$updated', '$stale', '$error']
+
+
+class SnapshotError(Exception):
+    """Raised when the snapshot can't be read."""
+
+
+def write_snapshot(rows):
+    """Saves the results of a scrape. rows is an iterable of (fic, flags) pairs, in the order they were shown."""
+
+    # Write to a temporary file first, so an interrupted scrape doesn't leave a half-written snapshot behind.
+    # Each scrape gets its own temporary file, as shards can finish at the same time. The last one to finish is kept.
+    descriptor, temp_path = tempfile.mkstemp(dir=constants.DATA_PATH, prefix="results.snapshot.", suffix=".tmp")
+
+    try:
+        with os.fdopen(descriptor, 'w') as file:
+            header = {'version': SNAPSHOT_VERSION, 'created': constants.NOW.strftime(constants.DATE_FORMAT), 'columns': COLUMNS + FLAGS}
+            file.write(json.dumps(header) + "\n")
+
+            for fic, flags in rows:
+                values = [fic.get(column) for column in COLUMNS] + [flags.get(flag) for flag in FLAGS]
+                file.write(json.dumps(values, separators=(',', ':'), default=format_date) + "\n")
+
+        os.replace(temp_path, SNAPSHOT_FILE_PATH)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def read_snapshot(columns=None):
+    """Yields each fic in the last snapshot as a dict. If columns is given, only those columns ('id' and the flags are always included) are kept."""
+
+    if not os.path.exists(SNAPSHOT_FILE_PATH) or os.path.getsize(SNAPSHOT_FILE_PATH) == 0:
+        raise SnapshotError("No cached table found. Run ao3scraper --scrape first.")
+
+    # The file is memory-mapped, so only the lines that are read are loaded.
+    with open(SNAPSHOT_FILE_PATH, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as snapshot:
+        header = json.loads(snapshot.readline())
+
+        if header.get('version') != SNAPSHOT_VERSION:
+            raise SnapshotError("The cached table was saved by a different version of ao3scraper. Run ao3scraper --scrape again.")
+
+        wanted = [(position, name) for position, name in enumerate(header['columns'])
+                  if columns is None or name in columns or name == 'id' or name in FLAGS]
+
+        dates = [name for position, name in wanted if name in constants.DATE_COLUMNS]
+
+        for line in iter(snapshot.readline, b""):
+            values = json.loads(line)
+            fic = {name: values[position] for position, name in wanted}
+
+            for name in dates:
+                if fic[name] is not None:
+                    fic[name] = datetime.strptime(fic[name], constants.DATE_FORMAT)
+
+            yield fic
+
+
+def format_date(value):
+    """Stores dates (the only values JSON can't store by itself) in DATE_FORMAT."""
+
+    if isinstance(value, datetime):
+        return value.strftime(constants.DATE_FORMAT)
+    raise TypeError(f"{type(value).__name__} can't be stored in a snapshot")
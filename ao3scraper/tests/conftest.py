@@ -0,0 +1,80 @@
+# Shared setup for the tests: a throwaway data and config location, and the mock AO3 server from benchmarks/.
+
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+PACKAGE_PATH = Path(__file__).resolve().parent.parent
+BENCHMARKS_PATH = PACKAGE_PATH.parent / "benchmarks"
+
+# ao3scraper uses flat imports (import constants), so its directory has to be on the path.
+sys.path.insert(0, str(PACKAGE_PATH))
+sys.path.insert(0, str(BENCHMARKS_PATH))
+
+# constants reads these when it is first imported, so they are set before any test imports it.
+# Otherwise the tests would create (or use) the real config.yaml and fics.db.
+HOME = tempfile.mkdtemp(prefix="ao3scraper-tests-")
+atexit.register(shutil.rmtree, HOME, ignore_errors=True)
+os.environ.update(HOME=HOME, XDG_DATA_HOME=f"{HOME}/data", XDG_CONFIG_HOME=f"{HOME}/config")
+os.environ.pop("DATABASE_FILE_PATH", None)
+
+from mock_server import MockAO3Handler, start_server, server_url, end_outage  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def mock_ao3():
+    """Starts the mock AO3 server, and returns its URL."""
+
+    server = start_server()
+    yield server_url(server)
+    server.shutdown()
+
+
+@pytest.fixture
+def mock_handler(mock_ao3):
+    """The mock server's handler class, whose counters and outage are reset after the test."""
+
+    yield MockAO3Handler
+    end_outage()
+
+
+@pytest.fixture
+def fast_retries(monkeypatch):
+    """Makes retries wait milliseconds instead of seconds."""
+
+    import constants
+
+    monkeypatch.setattr(constants, "BACKOFF_BASE", 0.01)
+    monkeypatch.setattr(constants, "BACKOFF_MAX", 0.05)
+    monkeypatch.setattr(constants, "MAX_RETRIES", 3)
+
+
+@pytest.fixture
+def fics():
+    """Adds fics to the test session's database, and deletes the ones that are left after the test."""
+
+    import database
+
+    added = []
+
+    def add(*fics):
+        """Takes fic IDs, or dicts of scraped columns with an 'id' key."""
+
+        fic_ids = [fic['id'] if isinstance(fic, dict) else fic for fic in fics]
+        database.add_all_fics(fic_ids)
+        database.update_all_fics([fic for fic in fics if isinstance(fic, dict)])
+        added.extend(fic_ids)
+
+    # Fics a test adds some other way can be appended, so they are deleted too.
+    add.added = added
+    yield add
+
+    remaining = set(database.get_fic_ids())
+    for fic_id in added:
+        if fic_id in remaining:
+            database.delete_fic(fic_id)
@@ -0,0 +1,161 @@
+# Tests for circuit_breaker.py, and for a scrape stopping during an outage of the mock AO3 server.
+
+import threading
+import time
+
+import pytest
+
+import circuit_breaker
+import constants
+import fetcher
+from circuit_breaker import CircuitBreaker, CircuitOpenError, CLOSED, OPEN, HALF_OPEN
+from mock_server import start_outage
+
+# The same settings as benchmarks/bench_outage.py: limits high enough that the mock server is what's being measured,
+# and a short cooldown.
+OUTAGE_CONFIG = {
+    'CONCURRENCY': 20,
+    'MAX_CONNECTIONS_PER_HOST': 20,
+    'REQUESTS_PER_SECOND': 1000,
+    'MIN_REQUESTS_PER_SECOND': 100,
+    'MAX_REQUESTS_PER_SECOND': 1000,
+    'BURST': 100,
+    'BACKOFF_BASE': 0.01,
+    'BACKOFF_MAX': 0.1,
+    'CIRCUIT_FAILURES': 5,
+    'CIRCUIT_COOLDOWN': 1,
+    'CIRCUIT_MAX_TRIPS': 3,
+    'HTTP_CACHE_SIZE': 0,
+    'PROCESSES': 1,
+}
+
+# The most work pages a scrape may request during an outage: every worker's request that was in flight when
+# the breaker opened, plus one probe per trip.
+MAX_OUTAGE_REQUESTS = OUTAGE_CONFIG['CONCURRENCY'] + OUTAGE_CONFIG['CIRCUIT_MAX_TRIPS']
+
+
+def test_opens_after_failures_in_a_row():
+    breaker = CircuitBreaker(failure_threshold=3, cooldown=60)
+
+    for _ in range(2):
+        breaker.failure(breaker.acquire())
+    assert breaker.state == CLOSED
+
+    breaker.failure(breaker.acquire())
+    assert breaker.state == OPEN
+    assert breaker.trips == 1
+
+
+def test_late_success_does_not_reset_failures():
+    breaker = CircuitBreaker(failure_threshold=2, cooldown=60)
+
+    # A request sent before the first failure finishes after it, as happens when an outage starts.
+    early = breaker.acquire()
+    breaker.failure(breaker.acquire())
+    breaker.success(early)
+
+    breaker.failure(breaker.acquire())
+    assert breaker.state == OPEN
+
+
+def test_failure_holds_back_new_requests():
+    breaker = CircuitBreaker(failure_threshold=3, cooldown=60)
+    first, second = breaker.acquire(), breaker.acquire()
+    breaker.failure(first)
+
+    # No new request is sent until the one still in flight reports back.
+    sent = threading.Event()
+    threading.Thread(target=lambda: (breaker.acquire(), sent.set()), daemon=True).start()
+    assert not sent.wait(0.1)
+
+    breaker.success(second)
+    assert sent.wait(1)
+    assert breaker.failures == 0
+
+
+def test_late_failure_is_not_taken_for_the_probe():
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=0.05)
+
+    # A request sent before the breaker opened times out while the probe is in flight.
+    early = breaker.acquire()
+    breaker.failure(breaker.acquire())
+    time.sleep(0.06)
+    probe = breaker.acquire()
+    breaker.failure(early)
+    assert breaker.state == HALF_OPEN
+    assert breaker.trips == 1
+
+    breaker.success(probe)
+    assert breaker.state == CLOSED
+    assert breaker.trips == 0
+
+
+def test_late_failure_while_open_is_ignored():
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=60)
+
+    early = breaker.acquire()
+    breaker.failure(breaker.acquire())
+    breaker.failure(early)
+    assert breaker.state == OPEN
+    assert breaker.failures == 1
+
+
+def test_probe_closes_or_reopens():
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=0.05)
+    breaker.failure(breaker.acquire())
+
+    # After the cooldown, one request is let through as a probe.
+    probe = breaker.acquire()
+    assert breaker.state == HALF_OPEN
+    breaker.failure(probe)
+    assert breaker.state == OPEN
+    assert breaker.trips == 2
+
+    breaker.success(breaker.acquire())
+    assert breaker.state == CLOSED
+    assert breaker.trips == 0
+
+
+def test_gives_up_after_max_trips():
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=0.01, max_trips=2)
+    breaker.failure(breaker.acquire())
+    breaker.failure(breaker.acquire())
+
+    with pytest.raises(CircuitOpenError):
+        breaker.acquire()
+
+
+@pytest.fixture
+def scrape(mock_ao3, monkeypatch):
+    """Returns a function that fetches works 100, 200, ... from the mock server with fetch_all, and returns the results."""
+
+    for name, value in OUTAGE_CONFIG.items():
+        monkeypatch.setattr(constants, name, value)
+    monkeypatch.setattr(fetcher, "WORK_URL", mock_ao3 + "/works/{}?view_adult=true")
+
+    def scrape(size):
+        results = {}
+        fetcher.fetch_all([work_id * 100 for work_id in range(1, size + 1)], results.__setitem__)
+        return results
+
+    return scrape
+
+
+def test_short_outage_is_waited_out(scrape, mock_handler):
+    start_outage(30, 0.5)
+    results = scrape(100)
+
+    assert len(results) == 100
+    assert not [result for result in results.values() if isinstance(result, Exception)]
+
+
+def test_long_outage_stops_the_scrape(scrape, mock_handler):
+    start_outage(50, float('inf'))
+
+    start = time.monotonic()
+    with pytest.raises(circuit_breaker.CircuitOpenError):
+        scrape(300)
+
+    # One cooldown per trip, and no more requests than the workers had in flight plus one probe per trip.
+    assert time.monotonic() - start < 10
+    assert mock_handler.outage_requests <= MAX_OUTAGE_REQUESTS
@@ -0,0 +1,116 @@
+# Tests for the daemon's control commands and how it saves each fetched fic. The daemon isn't started: its requests are
+# handled and its results saved directly, against the test session's own fics.db (see conftest.py).
+
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+import constants
+import daemon
+import database
+import fetcher
+import scheduler
+
+
+@pytest.fixture
+def watcher():
+    """A daemon that has loaded the database, as Daemon.run does before it starts fetching."""
+
+    instance = daemon.Daemon()
+    instance.wakeup = asyncio.Event()
+    instance.load()
+    instance.run_id = database.start_run([], instance.started)
+    instance.run_started = instance.started
+    instance.cache = None
+
+    yield instance
+
+    database.finish_run(instance.run_id)
+
+
+def test_add(watcher, fics):
+    fics.added.append(601)
+
+    assert watcher.handle_request({'command': 'add', 'url': "https://archiveofourown.org/works/601"}) == {'ok': True, 'id': 601}
+    assert 601 in database.get_fic_ids()
+
+    # A new fic is due straight away.
+    assert watcher.due[601] <= datetime.now()
+
+
+def test_add_duplicate(watcher, fics):
+    fics(602)
+    watcher.load()
+
+    reply = watcher.handle_request({'command': 'add', 'url': "https://archiveofourown.org/works/602"})
+    assert reply == {'ok': False, 'error': "602 already in database."}
+
+
+def test_add_invalid_url(watcher):
+    reply = watcher.handle_request({'command': 'add', 'url': "https://example.com/602"})
+    assert reply['ok'] is False
+
+
+def test_delete(watcher, fics):
+    fics(603)
+    watcher.load()
+
+    assert watcher.handle_request({'command': 'delete', 'id': 603}) == {'ok': True, 'id': 603}
+    assert 603 not in database.get_fic_ids()
+    assert 603 not in watcher.fics and 603 not in watcher.due
+
+
+def test_delete_unknown_or_bad_id(watcher):
+    assert watcher.handle_request({'command': 'delete', 'id': 604}) == {'ok': False, 'error': "604 is not in the database."}
+    assert watcher.handle_request({'command': 'delete', 'id': "abc"}) == {'ok': False, 'error': "abc is not a fic ID."}
+    assert watcher.handle_request({'command': 'delete'}) == {'ok': False, 'error': "None is not a fic ID."}
+
+
+def test_unknown_command(watcher):
+    assert watcher.handle_request({'command': 'restart'}) == {'ok': False, 'error': "Unknown command: restart"}
+
+
+def test_error_is_retried_after_the_shortest_interval(watcher, fics):
+    fics({'id': 611, 'title': "Title", 'kudos': 10})
+    watcher.load()
+
+    before = datetime.now()
+    watcher.save_result(611, AttributeError("Work page has no metadata"))
+
+    assert watcher.stats['errors'] == 1
+    assert before + timedelta(days=constants.MIN_CHECK_INTERVAL) <= watcher.due[611] <= datetime.now() + timedelta(days=constants.MIN_CHECK_INTERVAL)
+
+    # Errors aren't saved.
+    assert {'id': 611, 'kudos': 10, 'last_checked': None} in database.get_all_fics(['kudos', 'last_checked'])
+
+
+def test_deleted_fic_is_not_saved(watcher):
+    watcher.save_result(612, fetcher.UNCHANGED)
+    assert watcher.stats['checked'] == 0
+
+
+def test_changes_roll_over_into_a_new_run(watcher, fics):
+    updated = datetime(2024, 1, 1)
+    fics({'id': 621, 'title': "Title", 'date_updated': updated, 'nchapters': 1, 'kudos': 10})
+    watcher.load()
+
+    # The daemon's run has lasted longer than RUN_LENGTH by the time the fic is saved.
+    first_run = watcher.run_id
+    watcher.run_started -= daemon.RUN_LENGTH
+
+    watcher.save_result(621, {'id': 621, 'title': "Title", 'date_updated': updated + timedelta(days=1), 'nchapters': 2, 'kudos': 15})
+
+    assert watcher.run_id > first_run
+    assert watcher.stats['changed'] == 1
+    with database.engine.connect() as conn:
+        finished = conn.execute(database.select(database.Run.finished).where(database.Run.id == first_run)).scalar()
+    assert finished is not None
+
+    changes = database.get_changes_since(first_run)
+    assert [(change['run_id'], change['fic_id'], change['kudos'], change['nchapters']) for change in changes] == [(watcher.run_id, 621, 5, 1)]
+
+    # The daemon's copy of the fic is updated, and its next check is scheduled from the new values.
+    fic = watcher.fics[621]
+    assert (fic['kudos'], fic['nchapters'], fic['times_checked'], fic['times_changed']) == (15, 2, 1, 1)
+    assert watcher.due[621] == scheduler.next_check(fic, fic['last_checked'])
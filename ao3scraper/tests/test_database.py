@@ -0,0 +1,140 @@
+# Tests for the scrape runs and --list filters in database.py. They use the test session's own fics.db (see conftest.py).
+
+from datetime import datetime, timedelta
+
+import pytest
+
+import constants
+import database
+
+
+@pytest.fixture
+def runs():
+    """Removes the runs a test started."""
+
+    started = []
+    yield started
+
+    for run_id in started:
+        database.finish_run(run_id)
+
+
+def test_interrupted_scrape_is_resumed(fics, runs):
+    fics(1, 2, 3)
+    runs.append(database.start_run([1, 2, 3]))
+    database.save_checkpoint(runs[-1], [], [], [1])
+
+    assert database.get_unfinished_run() == runs[-1]
+    assert database.get_pending_ids(runs[-1]) == [2, 3]
+
+
+def test_daemon_run_does_not_hide_interrupted_scrape(runs):
+    runs.append(database.start_run([1, 2]))
+
+    # The daemon's run has no pending fics, and stays unfinished while the daemon runs.
+    runs.append(database.start_run([], datetime.now()))
+
+    assert database.get_unfinished_run() == runs[0]
+
+
+def test_shards_resume_their_own_scrapes(runs):
+    runs.append(database.start_run([1], shard="1/2"))
+    runs.append(database.start_run([2], shard="2/2"))
+
+    assert database.get_unfinished_run("1/2") == runs[0]
+    assert database.get_unfinished_run("2/2") == runs[1]
+    assert database.get_unfinished_run() is None
+
+
+def test_deleted_fic_is_not_resumed(fics, runs):
+    fics(104, 105, 106)
+    runs.append(database.start_run([104, 105, 106]))
+
+    database.delete_fic(105)
+
+    assert database.get_pending_ids(runs[-1]) == [104, 106]
+    with database.engine.connect() as conn:
+        assert not conn.execute(database.select(database.PendingFic).where(database.PendingFic.fic_id == 105)).all()
+
+
+def listed(fics=None, **options):
+    """Returns the IDs select_fics lists with options, in order. If fics is given, only those IDs are kept."""
+
+    with database.engine.connect() as conn:
+        fic_ids = conn.execute(database.select_fics(['id'], **options)).scalars().all()
+    return [fic_id for fic_id in fic_ids if fics is None or fic_id in fics]
+
+
+def test_fandom_filter_matches_start_ignoring_case(fics):
+    fics(
+        {'id': 201, 'fandoms': "Harry Potter - J. K. Rowling, Good Omens (TV)"},
+        {'id': 202, 'fandoms': "harry potter"},
+        {'id': 203, 'fandoms': "Star Wars"},
+    )
+    ids = {201, 202, 203}
+
+    assert listed(ids, filters={'fandom': "HARRY pot"}) == [201, 202]
+    assert listed(ids, filters={'fandom': "good omens"}) == [201]
+    assert listed(ids, filters={'fandom': "Omens"}) == []
+
+
+def test_fandoms_are_kept_in_step(fics):
+    fics({'id': 211, 'fandoms': "Good Omens (TV), Star Wars"})
+
+    # A scrape that finds different fandoms replaces the old ones.
+    database.update_all_fics([{'id': 211, 'fandoms': "Discworld"}])
+    assert listed({211}, filters={'fandom': "Good Omens"}) == []
+    assert listed({211}, filters={'fandom': "Discworld"}) == [211]
+
+    # Fics saved without their fandoms (e.g. unchanged ones) keep them.
+    database.update_all_fics([{'id': 211, 'kudos': 5}])
+    assert listed({211}, filters={'fandom': "Discworld"}) == [211]
+
+    database.delete_fic(211)
+    with database.engine.connect() as conn:
+        assert not conn.execute(database.select(database.FicFandom).where(database.FicFandom.fic_id == 211)).all()
+
+
+def test_status_and_complete_filters(fics):
+    fics(
+        {'id': 221, 'status': "Completed", 'complete': True},
+        {'id': 222, 'status': "Updated", 'complete': False},
+    )
+    ids = {221, 222}
+
+    assert listed(ids, filters={'status': "completed"}) == [221]
+    assert listed(ids, filters={'complete': False}) == [222]
+
+
+def test_stale_filter_matches_is_stale(fics):
+    # is_stale() in __main__.py counts whole days since the update, and doesn't count fics that haven't been scraped.
+    threshold = constants.STALE_THRESHOLD
+    fics(
+        {'id': 231, 'date_updated': constants.NOW - timedelta(days=threshold + 1)},
+        {'id': 232, 'date_updated': constants.NOW - timedelta(days=threshold + 1) + timedelta(seconds=1)},
+        {'id': 233, 'date_updated': constants.NOW},
+        234,
+    )
+    ids = {231, 232, 233, 234}
+
+    assert listed(ids, filters={'stale': True}) == [231]
+
+    # Listed newest first, with fics that haven't been scraped last.
+    assert listed(ids, filters={'stale': False}) == [233, 232, 234]
+
+
+def test_updated_since_includes_the_day(fics):
+    day = datetime(2024, 1, 1)
+    fics(
+        {'id': 241, 'date_updated': day - timedelta(seconds=1)},
+        {'id': 242, 'date_updated': day},
+        {'id': 243, 'date_updated': day + timedelta(days=3)},
+    )
+
+    assert listed({241, 242, 243}, filters={'updated_since': day}) == [243, 242]
+
+
+def test_sort_breaks_ties_by_id(fics):
+    fics({'id': 251, 'kudos': 10}, {'id': 252, 'kudos': 30}, {'id': 253, 'kudos': 10})
+
+    assert listed({251, 252, 253}, sort='kudos') == [252, 253, 251]
@@ -0,0 +1,62 @@
+# Tests for fetcher.fetch_metadata and the page cache, against the mock AO3 server.
+
+import sqlite3
+
+import pytest
+import requests
+
+import fetcher
+import http_cache
+from rate_limiter import RateLimiter
+
+
+@pytest.fixture
+def fetch(mock_ao3, monkeypatch, tmp_path):
+    """Returns a function that fetches a work from the mock server through a page cache, the way a scrape does."""
+
+    monkeypatch.setattr(fetcher, "WORK_URL", mock_ao3 + "/works/{}?view_adult=true")
+
+    session = requests.Session()
+    limiter = RateLimiter(rate=100, burst=10, min_rate=1, max_rate=100)
+    cache = http_cache.ResponseCache(tmp_path / "http_cache.db", max_size=10 * 1024 * 1024)
+
+    def fetch(work_id, known=False, saved_digest=None):
+        return fetcher.fetch_metadata(work_id, session, limiter, cache, known, saved_digest=saved_digest)
+
+    fetch.cache = cache
+    yield fetch
+
+    cache.close()
+    session.close()
+
+
+def test_unchanged_page_is_skipped(fetch):
+    row = fetch(100)
+    assert row['title'] == "Test Work"
+
+    # The mock server sends a new CSRF token every time, which the page digest ignores.
+    assert fetch(100, known=True, saved_digest=row['metadata_digest']) is fetcher.UNCHANGED
+    assert fetch.cache.stats['hits'] == 1
+
+
+def test_page_that_fails_to_parse_is_not_cached(fetch):
+    # The mock server serves the login page for 190, as AO3 does for restricted works.
+    with pytest.raises(AttributeError):
+        fetch(190)
+
+    # It has to keep failing, rather than be skipped as an unchanged page.
+    with pytest.raises(AttributeError):
+        fetch(190, known=True)
+
+    assert fetch.cache.get(190) is None
+
+
+def test_cache_does_not_hold_a_write_lock(fetch, tmp_path):
+    fetch(100)
+    fetch.cache.get(100)
+
+    # Another scrape using the same cache can write to it straight away.
+    other = sqlite3.connect(tmp_path / "http_cache.db", timeout=0)
+    other.execute("UPDATE responses SET last_used = 0")
+    other.commit()
+    other.close()
@@ -0,0 +1,70 @@
+# Tests for --import (import_urls in __main__.py). They use the test session's own fics.db (see conftest.py).
+
+import importlib.util
+import io
+from pathlib import Path
+
+import pytest
+
+import database
+
+# __main__.py can't be imported by its name, which is the running program's.
+spec = importlib.util.spec_from_file_location("ao3scraper_main", Path(__file__).resolve().parents[1] / "__main__.py")
+main = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(main)
+
+
+def urls(*work_ids):
+    return [f"https://archiveofourown.org/works/{work_id}\n" for work_id in work_ids]
+
+
+@pytest.fixture
+def batches(monkeypatch):
+    """Records the size of every batch import_urls adds to the database."""
+
+    sizes = []
+    add_all_fics = database.add_all_fics
+
+    def add(fic_ids):
+        sizes.append(len(fic_ids))
+        return add_all_fics(fic_ids)
+
+    monkeypatch.setattr(database, "add_all_fics", add)
+    return sizes
+
+
+def test_counts_added_duplicate_and_invalid(fics):
+    fics(503)
+    fics.added.extend([501, 502])
+
+    file = io.StringIO("".join([
+        "\n",
+        "# A comment\n",
+        *urls(501, 502),
+        "   \n",
+        "https://archiveofourown.org/works/501/chapters/1234\n",
+        "not a url\n",
+        *urls(503),
+    ]))
+
+    assert main.import_urls(file) == (2, 2, 1)
+    assert [fic_id for fic_id in database.get_fic_ids() if fic_id in (501, 502, 503)] == [501, 502, 503]
+
+
+def test_counts_across_batches(fics, batches, monkeypatch):
+    monkeypatch.setattr(main, "IMPORT_BATCH_SIZE", 2)
+    fics(513)
+    fics.added.extend([511, 512, 514, 515])
+    batches.clear()
+
+    # 511 is repeated after its batch was added, and 513 is already in the database.
+    file = io.StringIO("".join(urls(511, 512, 513, 511, 514, 515)))
+
+    assert main.import_urls(file) == (4, 2, 0)
+    assert batches == [2, 2, 1]
+    assert [fic_id for fic_id in database.get_fic_ids() if 511 <= fic_id <= 515] == [511, 512, 513, 514, 515]
+
+
+def test_empty_file():
+    assert main.import_urls(io.StringIO("")) == (0, 0, 0)
+    assert main.import_urls(io.StringIO("# Only a comment\n\n")) == (0, 0, 0)
@@ -0,0 +1,138 @@
+# Tests for rate_limiter.py, and for fetcher.request_page retrying against the mock AO3 server.
+
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+import requests
+
+import constants
+import fetcher
+import metrics
+import rate_limiter
+from rate_limiter import RateLimiter, RATE_INCREASE
+from mock_server import start_outage
+
+
+def test_parse_retry_after_seconds():
+    assert rate_limiter.parse_retry_after("120") == 120
+    assert rate_limiter.parse_retry_after(" 0 ") == 0
+
+
+def test_parse_retry_after_http_date():
+    then = datetime.now(timezone.utc) + timedelta(seconds=30)
+    assert rate_limiter.parse_retry_after(format_datetime(then, usegmt=True)) == pytest.approx(30, abs=2)
+
+    # A date that has already passed means the request can be retried straight away.
+    past = datetime.now(timezone.utc) - timedelta(hours=1)
+    assert rate_limiter.parse_retry_after(format_datetime(past, usegmt=True)) == 0
+
+
+def test_parse_retry_after_unreadable():
+    assert rate_limiter.parse_retry_after(None) is None
+    assert rate_limiter.parse_retry_after("soon") is None
+
+
+def test_backoff_bounds(monkeypatch):
+    monkeypatch.setattr(constants, "BACKOFF_BASE", 2)
+    monkeypatch.setattr(constants, "BACKOFF_MAX", 60)
+
+    for attempt in range(10):
+        delays = [rate_limiter.backoff(attempt) for _ in range(200)]
+        assert all(0 <= delay <= min(60, 2 * 2 ** attempt) for delay in delays)
+
+    # Full jitter spreads the retries over the whole window, instead of sending them all at its end.
+    delays = [rate_limiter.backoff(10) for _ in range(200)]
+    assert min(delays) < 20 and max(delays) > 40
+
+
+def test_success_raises_rate_up_to_max():
+    limiter = RateLimiter(rate=1, burst=1, min_rate=0.1, max_rate=1.2)
+
+    limiter.success()
+    assert limiter.rate == pytest.approx(1 + RATE_INCREASE)
+
+    for _ in range(10):
+        limiter.success()
+    assert limiter.rate == 1.2
+
+
+def test_failure_halves_rate_down_to_min():
+    limiter = RateLimiter(rate=100, burst=1, min_rate=10, max_rate=100)
+
+    limiter.failure()
+    assert limiter.rate == 50
+
+    # Failures reported in the same window (one request at the current rate) only decrease the rate once.
+    limiter.failure()
+    assert limiter.rate == 50
+
+    for _ in range(5):
+        time.sleep(0.11)
+        limiter.failure()
+    assert limiter.rate == 10
+
+
+def test_retry_after_pauses_every_worker():
+    limiter = RateLimiter(rate=1000, burst=10, min_rate=1, max_rate=1000)
+    limiter.failure(retry_after=0.3)
+
+    # Another worker that tries to send a request has to wait out the pause too.
+    waited = []
+
+    def worker():
+        start = time.monotonic()
+        limiter.acquire()
+        waited.append(time.monotonic() - start)
+
+    threads = [threading.Thread(target=worker) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(waited) == 3
+    assert all(wait >= 0.25 for wait in waited)
+
+
+def test_close_wakes_waiting_workers():
+    limiter = RateLimiter(rate=1000, burst=1, min_rate=1, max_rate=1000)
+    limiter.failure(retry_after=60)
+
+    threading.Timer(0.1, limiter.close).start()
+    start = time.monotonic()
+    with pytest.raises(rate_limiter.LimiterClosed):
+        limiter.acquire()
+    assert time.monotonic() - start < 5
+
+
+@pytest.mark.parametrize("work_id, status", [(198, 503), (199, 429)])
+def test_request_page_retries_then_succeeds(mock_ao3, mock_handler, fast_retries, work_id, status):
+    # The mock server answers these IDs with status the first time, and with the work after that.
+    limiter = RateLimiter(rate=100, burst=10, min_rate=1, max_rate=100)
+    before = mock_handler.requests
+    metrics.reset()
+
+    with requests.Session() as session:
+        response = fetcher.request_page(f"{mock_ao3}/works/{work_id}", session, limiter)
+
+    assert response.status_code == 200
+    assert b"work meta group" in response.content
+    assert mock_handler.requests - before == 2
+    assert metrics.counters[("retries", f"HTTP {status}")] == 1
+
+    # The failed attempt lowered the rate, and the success raised it again a little.
+    assert limiter.rate == pytest.approx(50 + RATE_INCREASE)
+
+
+def test_request_page_gives_up_after_max_retries(mock_ao3, mock_handler, fast_retries):
+    limiter = RateLimiter(rate=100, burst=10, min_rate=1, max_rate=100)
+    start_outage(0, 60)
+
+    with requests.Session() as session:
+        response = fetcher.request_page(f"{mock_ao3}/works/100", session, limiter)
+
+    assert response.status_code == 503
+    assert mock_handler.outage_requests == constants.MAX_RETRIES + 1
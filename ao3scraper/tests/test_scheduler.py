@@ -0,0 +1,117 @@
+# Tests for scheduler.py, with fixed settings and a fixed now.
+
+from datetime import datetime, timedelta
+
+import pytest
+
+import constants
+import scheduler
+
+NOW = datetime(2024, 6, 1, 12, 0, 0)
+
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch):
+    monkeypatch.setattr(constants, "STALE_THRESHOLD", 30)
+    monkeypatch.setattr(constants, "MIN_CHECK_INTERVAL", 1)
+    monkeypatch.setattr(constants, "MAX_CHECK_INTERVAL", 30)
+    monkeypatch.setattr(constants, "COMPLETE_CHECK_MULTIPLIER", 4)
+    monkeypatch.setattr(constants, "SCRAPE_BUDGET", 0)
+
+
+def fic(fic_id=1, updated_days_ago=10, checked_days_ago=1, complete=False, times_checked=0, times_changed=0):
+    """Returns a scraped fic with the columns the scheduler reads."""
+
+    return {
+        'id': fic_id,
+        'title': "Title",
+        'nchapters': 3,
+        'date_updated': NOW - timedelta(days=updated_days_ago),
+        'last_checked': NOW - timedelta(days=checked_days_ago),
+        'complete': complete,
+        'times_checked': times_checked,
+        'times_changed': times_changed,
+    }
+
+
+def test_recent_fics_are_checked_as_often_as_allowed():
+    assert scheduler.check_interval(fic(updated_days_ago=0), NOW) == 1
+    assert scheduler.check_interval(fic(updated_days_ago=29), NOW) == 1
+
+
+def test_interval_grows_with_age():
+    assert scheduler.check_interval(fic(updated_days_ago=90), NOW) == pytest.approx(3)
+    assert scheduler.check_interval(fic(updated_days_ago=300), NOW) == pytest.approx(10)
+
+
+def test_complete_fics_are_checked_less_often():
+    assert scheduler.check_interval(fic(updated_days_ago=90, complete=True), NOW) == pytest.approx(12)
+
+
+def test_change_rate_scales_the_interval():
+    # No history (or history with as many changes as not) leaves the interval as it is.
+    assert scheduler.check_interval(fic(updated_days_ago=90, times_checked=None, times_changed=None), NOW) == pytest.approx(3)
+    assert scheduler.check_interval(fic(updated_days_ago=90, times_checked=4, times_changed=2), NOW) == pytest.approx(3)
+
+    # A fic that changed on 8 of 8 checks has a change rate of 9/10, and one that never did 1/10.
+    assert scheduler.check_interval(fic(updated_days_ago=300, times_checked=8, times_changed=8), NOW) == pytest.approx(10 * 0.5 / 0.9)
+    assert scheduler.check_interval(fic(updated_days_ago=90, times_checked=8, times_changed=0), NOW) == pytest.approx(15)
+
+
+def test_interval_is_clamped():
+    assert scheduler.check_interval(fic(updated_days_ago=90, complete=True, times_checked=8), NOW) == 30
+    assert scheduler.check_interval(fic(updated_days_ago=0, times_checked=8, times_changed=8), NOW) == 1
+
+
+def test_priority_is_how_overdue_a_fic_is():
+    assert scheduler.priority(fic(checked_days_ago=2), NOW) == pytest.approx(2)
+    assert scheduler.priority(fic(updated_days_ago=90, checked_days_ago=1.5), NOW) == pytest.approx(0.5)
+
+    unscraped = {**fic(), 'title': None, 'date_updated': None, 'last_checked': None}
+    assert scheduler.priority(unscraped, NOW) == float('inf')
+    assert scheduler.next_check(unscraped, NOW) == NOW
+
+
+def test_next_check_is_one_interval_after_the_last():
+    assert scheduler.next_check(fic(updated_days_ago=90, checked_days_ago=1), NOW) == NOW + timedelta(days=2)
+
+
+def test_due_fics_are_most_overdue_first():
+    fics = [
+        fic(1, checked_days_ago=2),
+        fic(2, checked_days_ago=0.5),
+        fic(3, checked_days_ago=5),
+        {**fic(4), 'last_checked': None},
+        fic(5, updated_days_ago=90, checked_days_ago=3),
+    ]
+
+    assert scheduler.get_due_ids(fics, now=NOW) == [4, 3, 1, 5]
+
+
+def test_budget_limits_due_fics():
+    fics = [fic(fic_id, checked_days_ago=fic_id) for fic_id in range(1, 6)]
+
+    assert scheduler.get_due_ids(fics, budget=2, now=NOW) == [5, 4]
+
+    # A budget of 0 (the default) means there is no limit.
+    assert scheduler.get_due_ids(fics, now=NOW) == [5, 4, 3, 2, 1]
+
+
+def test_record_check_counts_changes():
+    local_fic = fic(times_checked=3, times_changed=1)
+
+    unchanged = scheduler.record_check(local_fic, {'id': 1}, NOW)
+    assert unchanged == {'id': 1, 'last_checked': NOW, 'times_checked': 4}
+
+    same = scheduler.record_check(local_fic, {'id': 1, 'date_updated': local_fic['date_updated'], 'nchapters': 3}, NOW)
+    assert (same['times_checked'], same['times_changed']) == (4, 1)
+
+    updated = scheduler.record_check(local_fic, {'id': 1, 'date_updated': NOW, 'nchapters': 4}, NOW)
+    assert (updated['times_checked'], updated['times_changed']) == (4, 2)
+
+
+def test_first_scrape_is_not_a_change():
+    local_fic = {**fic(times_checked=None, times_changed=None), 'date_updated': None}
+
+    scraped = scheduler.record_check(local_fic, {'id': 1, 'date_updated': NOW, 'nchapters': 1}, NOW)
+    assert (scraped['times_checked'], scraped['times_changed']) == (1, 0)
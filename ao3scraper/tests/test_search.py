@@ -0,0 +1,88 @@
+# Tests for --search: the full-text index kept by the triggers from file_validator.create_search_index, the migration
+# that adds it, and select_fics and count_matches. They use the test session's own fics.db (see conftest.py).
+
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+import constants
+import database
+
+REPO_PATH = Path(__file__).resolve().parents[2]
+
+
+def matches(search, sort=None):
+    """Returns the IDs of the fics select_fics finds for search, in order."""
+
+    with database.engine.connect() as conn:
+        return conn.execute(database.select_fics(['id'], search=search, sort=sort)).scalars().all()
+
+
+def test_index_follows_inserts_updates_and_deletes(fics):
+    fics({'id': 401, 'title': "Zyxwv and the Quux"})
+    assert matches("zyxwv") == [401]
+
+    database.update_all_fics([{'id': 401, 'title': "Plugh"}])
+    assert matches("zyxwv") == []
+    assert matches("plugh") == [401]
+
+    # Updating a column that isn't indexed leaves the fic's entry as it was.
+    database.update_all_fics([{'id': 401, 'kudos': 3}])
+    assert matches("plugh") == [401]
+
+    database.delete_fic(401)
+    assert matches("plugh") == []
+
+
+def test_every_search_column_is_indexed(fics):
+    fics({'id': 411, **{column: f"xyzzy{column}" for column in constants.SEARCH_COLUMNS}})
+
+    for column in constants.SEARCH_COLUMNS:
+        assert matches(f"{column}: xyzzy{column}") == [411]
+
+
+def test_ranked_and_sorted_searches_find_the_same_fics(fics):
+    fics(
+        {'id': 421, 'title': "Frobnicate", 'kudos': 5},
+        {'id': 422, 'summary': "frobnicate frobnicate frobnicate", 'kudos': 50},
+        {'id': 423, 'tags': "Frobnicated", 'kudos': 500},
+        {'id': 424, 'title': "Something else", 'kudos': 5000},
+    )
+
+    assert sorted(matches("frobnicat*")) == [421, 422, 423]
+    assert matches("frobnicat*", sort='kudos') == [423, 422, 421]
+
+
+def test_bad_query_raises_search_error():
+    with pytest.raises(database.SearchError):
+        database.count_matches('"unterminated')
+
+    with pytest.raises(database.SearchError):
+        database.count_matches("nosuchcolumn: word")
+
+
+def test_migration_indexes_existing_fics(tmp_path, monkeypatch):
+    from alembic import command
+    from alembic.config import Config
+
+    # A copy of the session's database, taken back to the revision before full-text search, with a fic in it.
+    path = tmp_path / "fics.db"
+    with sqlite3.connect(constants.DATABASE_FILE_PATH) as source, sqlite3.connect(path) as copy:
+        source.backup(copy)
+
+    monkeypatch.setenv("DATABASE_FILE_PATH", str(path))
+    config = Config(str(REPO_PATH / "alembic.ini"))
+    config.set_main_option("script_location", str(REPO_PATH / "alembic"))
+    command.downgrade(config, "6a3d8e5f1b92")
+
+    connection = sqlite3.connect(path)
+    connection.execute("INSERT INTO fics (id, title, summary) VALUES (431, 'Indexed later', 'A summary about grommets')")
+    connection.commit()
+    connection.close()
+
+    command.upgrade(config, "4e8a1c7b3f25")
+
+    connection = sqlite3.connect(path)
+    assert connection.execute("SELECT rowid FROM fics_fts WHERE fics_fts MATCH 'grommets'").fetchall() == [(431,)]
+    connection.close()
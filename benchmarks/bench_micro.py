@@ -0,0 +1,313 @@
+# Benchmarks the parts of a scrape separately: startup, parsing, rendering, the database, and merging scrape results.
+
+"""
+Usage: python benchmarks/bench_micro.py [--quick]
+
+Exits with status 1 if --version or --help take longer than IMPORT_BUDGET seconds to start.
+--quick uses smaller sizes, for a fast check that everything still runs.
+"""
+
+import argparse
+import contextlib
+import copy
+import importlib.util
+import io
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from environment import Environment, MAIN_PATH
+from mock_server import FIXTURES_PATH, start_server, server_url
+
+# How long ao3scraper --version and --help may take to start, in seconds
+IMPORT_BUDGET = 0.5
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def report(name, seconds, count=None, unit="items"):
+    rate = f" ({count / seconds:,.0f} {unit}/s)" if count else ""
+    print(f"  {name:<45} {seconds:>9.3f} s{rate}")
+
+
+def fixture_pages(count):
+    pages = [(FIXTURES_PATH / name).read_bytes() for name in ["work.html", "oneshot.html"]]
+    return [(work_id, pages[work_id % 2].replace(b"WORK_ID", str(work_id).encode())) for work_id in range(count)]
+
+
+def bench_startup(environment):
+    print("Startup")
+    over_budget = False
+
+    for args in [["--version"], ["--help"]]:
+        # The best of five runs, so that a cold disk cache doesn't count.
+        wall = min(environment.run(*args)[0] for _ in range(5))
+        within = wall <= IMPORT_BUDGET
+        over_budget |= not within
+        print(f"  ao3scraper {args[0]:<34} {wall:>9.3f} s ({'within' if within else 'OVER'} the {IMPORT_BUDGET} s budget)")
+
+    return over_budget
+
+
+def parse_all(pages):
+    import fetcher
+    return [fetcher.parse_page(work_id, content) for work_id, content in pages]
+
+
+def bench_parse(page_count):
+    import fetcher
+
+    print(f"Parsing {page_count} work pages")
+    pages = fixture_pages(page_count)
+
+    seconds, _ = timed(parse_all, pages)
+    report("in this process", seconds, page_count, "pages")
+
+    # Parsing in a pool of processes, the way fetcher does when processes is above 1
+    for processes in sorted({2, os.cpu_count() or 1}):
+        with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn")) as pool:
+            # Start the processes before timing, as fetcher's pool is started once per scrape.
+            list(pool.map(parse_all, [pages[:1]] * processes))
+            seconds, _ = timed(lambda: list(pool.map(fetcher.parse_page, *zip(*pages), chunksize=16)))
+        report(f"in {processes} processes", seconds, page_count, "pages")
+
+
+def old_metadata(work_id, content):
+    """Parses a work the way AO3.Work(work_id).metadata does: the whole page, with every chapter loaded."""
+    import AO3
+    from bs4 import BeautifulSoup
+
+    work = AO3.Work(work_id, load=False)
+    work._soup = BeautifulSoup(content, "lxml")
+    work.load_chapters()
+    return work.metadata
+
+
+def bench_fetch(url, work_count):
+    """Compares the bytes downloaded and the parse time of AO3.Work(id).metadata, which requests the entire work
+    (view_full_work=true), with fetcher.fetch_metadata, which requests the first chapter and parses only the metadata."""
+    import requests
+    import fetcher
+
+    print(f"Fetching and parsing {work_count} works (AO3.Work(id).metadata vs fetcher)")
+
+    # Only IDs the mock server serves a work for, half multi-chapter works and half oneshots
+    work_ids = [work_id for work_id in range(work_count * 2) if work_id % 100 < 80][:work_count]
+
+    paths = [
+        ("AO3.Work(id).metadata", "/works/{}?view_adult=true&view_full_work=true", old_metadata),
+        ("fetcher.fetch_metadata", "/works/{}?view_adult=true", fetcher.parse_page),
+    ]
+
+    with requests.Session() as session:
+        for name, path, parse in paths:
+            pages = [(work_id, session.get(url + path.format(work_id)).content) for work_id in work_ids]
+            size = sum(len(content) for _, content in pages)
+            seconds, _ = timed(lambda: [parse(work_id, content) for work_id, content in pages])
+            print(f"  {name:<24} {size / len(pages) / 1024:>7.1f} KB per work {seconds:>9.3f} s to parse ({len(pages) / seconds:,.0f} works/s)")
+
+
+def load_main():
+    """Imports ao3scraper's __main__.py as a module, without running it."""
+
+    spec = importlib.util.spec_from_file_location("ao3scraper_main", MAIN_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def scraped_fic(work_id, metadata):
+    """Turns parsed metadata into a row, the way scrape_urls stores it."""
+
+    fic = {key: ", ".join(value) if isinstance(value, list) else value for key, value in metadata.items()}
+    fic['id'] = work_id
+    return fic
+
+
+def old_add_row(main, fic, count, styling="", difference=0):
+    """add_row as it was before TABLE_TEMPLATE was compiled into formatters: it copied each fic, reformatted every
+    field, then looked each column up in the template."""
+    import constants
+
+    fic = copy.copy(fic)
+    index = str(count + 1)
+    fic_link = f"https://archiveofourown.org/works/{fic['id']}"
+
+    if fic['expected_chapters'] is None or fic['expected_chapters'] == "None":
+        fic['expected_chapters'] = '?'
+
+    stale = main.is_stale(fic)
+
+    for column in constants.DATE_COLUMNS:
+        if fic[column] is not None:
+            fic[column] = fic[column].strftime("%Y-%m-%d")
+
+    if styling == constants.UPDATED_STYLES:
+        fic['$chapters'] = f"{fic['nchapters']}/{fic['expected_chapters']} (+{difference})"
+    else:
+        fic['$chapters'] = f"{fic['nchapters']}/{fic['expected_chapters']}"
+
+    fic['$latest_chapter'] = fic['chapter_titles'][-1]
+
+    for data in fic:
+        if isinstance(fic[data], str):
+            fic[data] = (fic[data][:constants.MAX_ROW_LENGTH].strip() + '...') if len(fic[data]) > constants.MAX_ROW_LENGTH else fic[data]
+
+    new_args = []
+    for count, zipped in enumerate(zip(main.args, constants.TABLE_TEMPLATE)):
+        if constants.TABLE_TEMPLATE[count]['column'] == 'title':
+            new_args.append(f"[link={fic_link}]{fic['title']}[/link]")
+        else:
+            new_args.append(str(fic[constants.TABLE_TEMPLATE[count]['column']]))
+    new_args.insert(0, f"{index}.")
+
+    main.table.add_row(*new_args, style=constants.STALE_STYLES if stale else styling)
+
+
+def bench_render(main, row_count):
+    import fetcher
+
+    print(f"Rendering {row_count} rows")
+    metadata = [scraped_fic(work_id, fetcher.parse_page(work_id, content)) for work_id, content in fixture_pages(2)]
+    fics = [dict(metadata[number % 2], id=number) for number in range(row_count)]
+
+    main.create_table()
+    seconds, _ = timed(lambda: [old_add_row(main, fic, count) for count, fic in enumerate(fics)])
+    report("add_row before TABLE_TEMPLATE was compiled", seconds, row_count, "rows")
+
+    main.create_table()
+    seconds, _ = timed(lambda: [main.add_row(fic, count) for count, fic in enumerate(fics)])
+    report("add_row", seconds, row_count, "rows")
+
+    import output
+    writer = output.create_writer("jsonl", io.StringIO())
+    seconds, _ = timed(lambda: [writer.write(fic, {}) for fic in fics])
+    report("--format jsonl", seconds, row_count, "rows")
+
+
+def reset_database():
+    import database
+
+    with database.engine.begin() as conn:
+        for table in ["fics", "fic_fandoms", "fic_history", "pending_fics", "runs"]:
+            conn.exec_driver_sql(f"DELETE FROM {table}")
+
+
+def marshmallow_fics():
+    """Reads every fic the way get_all_fics used to: as ORM objects, each dumped through a new FanficSchema."""
+    import database
+
+    schema = database.get_fanfic_schema()
+    with database.Session() as session:
+        return [schema().dump(fic) for fic in session.query(database.Fanfic).all()]
+
+
+def bench_database(fic_counts, update_counts):
+    """Times importing, writing and reading each of fic_counts fics. Writes are timed for each of update_counts scraped
+    fics (up to the number of fics), so their cost can be compared across both."""
+    import database
+    import fetcher
+
+    metadata = scraped_fic(0, fetcher.parse_page(0, fixture_pages(1)[0][1]))
+
+    for fic_count in fic_counts:
+        print(f"Database with {fic_count} fics")
+        reset_database()
+
+        seconds, _ = timed(database.add_all_fics, list(range(1, fic_count + 1)))
+        report("add_all_fics (--import)", seconds, fic_count, "fics")
+
+        written = 0
+        for update_count in update_counts:
+            if update_count > fic_count:
+                continue
+            rows = [dict(metadata, id=work_id) for work_id in range(1, update_count + 1)]
+            seconds, _ = timed(database.update_all_fics, rows)
+            report(f"update_all_fics ({update_count} scraped fics)", seconds, update_count, "fics")
+            written = max(written, update_count)
+
+        # Every fic is read back with its metadata, as after a full scrape.
+        database.update_all_fics([dict(metadata, id=work_id) for work_id in range(written + 1, fic_count + 1)])
+
+        seconds, fics = timed(marshmallow_fics)
+        report("FanficSchema().dump for each fic (before)", seconds, len(fics), "fics")
+
+        seconds, fics = timed(database.get_all_fics)
+        report("get_all_fics", seconds, len(fics), "fics")
+
+        seconds, _ = timed(lambda: next(database.iter_fics(None, 50)))
+        report("iter_fics (first page of --list)", seconds)
+
+
+def bench_merge(main, sizes):
+    """Runs scrape_urls with a fetcher that returns parsed rows straight away, so only placing, merging and
+    saving the results is measured."""
+    import fetcher
+    import output
+
+    print("Merging scrape results (stubbed fetcher)")
+    row = fetcher.to_row(fetcher.parse_page(0, fixture_pages(1)[0][1]))
+
+    def fetch_all(work_ids, on_result, digests=None):
+        for work_id in work_ids:
+            on_result(work_id, dict(row, id=work_id))
+
+    real_fetch_all = fetcher.fetch_all
+    fetcher.fetch_all = fetch_all
+
+    try:
+        for size in sizes:
+            import database
+            reset_database()
+            database.add_all_fics(list(range(1, size + 1)))
+
+            writer = output.create_writer("jsonl", io.StringIO())
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                seconds, _ = timed(main.scrape_urls, True, None, False, writer)
+            report(f"scrape_urls with {size} works", seconds, size, "works")
+    finally:
+        fetcher.fetch_all = real_fetch_all
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quick", action="store_true", help="use smaller sizes")
+    options = parser.parse_args()
+
+    server = start_server()
+    environment = Environment(server_url(server))
+    environment.activate()
+
+    over_budget = bench_startup(environment)
+
+    # The rest runs in this process, against the environment's database.
+    scraper = load_main()
+
+    if options.quick:
+        bench_fetch(server_url(server), 50)
+        bench_parse(50)
+        bench_render(scraper, 5000)
+        bench_database([1000, 10000], [100, 1000, 10000])
+        bench_merge(scraper, [100, 1000])
+    else:
+        bench_fetch(server_url(server), 500)
+        bench_parse(500)
+        bench_render(scraper, 50000)
+        bench_database([10000, 100000], [1000, 10000, 100000])
+        bench_merge(scraper, [1000, 10000, 100000])
+
+    environment.close()
+    server.shutdown()
+
+    if over_budget:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
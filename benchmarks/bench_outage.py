@@ -0,0 +1,94 @@
+# Checks how a scrape behaves when the mock AO3 server goes down part of the way through it.
+
+"""
+Usage: python benchmarks/bench_outage.py [--size 1000] [--after 200]
+
+Two outages are simulated, both starting after --after work pages:
+- a short one (shorter than circuit_cooldown): the scrape should wait it out and finish every work;
+- a long one: the scrape should stop soon after it starts, with few requests sent during it, and the works it didn't
+  get to should be left for --scrape --resume, which is run once the outage ends.
+It exits with status 1 if any of these don't hold.
+"""
+
+import argparse
+import json
+import sqlite3
+import sys
+import tempfile
+
+from environment import BENCHMARK_CONFIG, Environment
+from mock_server import MockAO3Handler, start_server, server_url, start_outage, end_outage
+
+OUTAGE_CONFIG = {
+    'circuit_failures': 5,
+    'circuit_cooldown': 1,
+    'circuit_max_trips': 3,
+}
+
+# The most work pages a stopped scrape may request during the outage: every worker's request that was in flight when
+# the breaker opened, plus one probe per trip.
+MAX_OUTAGE_REQUESTS = BENCHMARK_CONFIG['concurrency'] + OUTAGE_CONFIG['circuit_max_trips']
+
+
+def import_works(environment, size):
+    with tempfile.TemporaryFile("w+") as urls:
+        for work_id in range(1, size + 1):
+            # Only plain works, so every error comes from the outage
+            urls.write(f"https://archiveofourown.org/works/{work_id * 100}\n")
+        urls.seek(0)
+        environment.run("--import", "-", stdin=urls)
+
+
+def read_metrics(environment, run_id):
+    return json.loads((environment.data_path / "metrics" / f"run-{run_id}.json").read_text())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=1000, help="number of works to scrape")
+    parser.add_argument("--after", type=int, default=200, help="work pages served before each outage starts")
+    options = parser.parse_args()
+
+    server = start_server()
+    url = server_url(server)
+    failed = []
+
+    def check(condition, message):
+        print(f"  {'ok' if condition else 'FAILED'}: {message}")
+        if not condition:
+            failed.append(message)
+
+    with Environment(url, OUTAGE_CONFIG) as environment:
+        import_works(environment, options.size)
+
+        print(f"Short outage (0.5 s) after {options.after} works:")
+        start_outage(options.after, 0.5)
+        wall, _, code = environment.run("--scrape", "--all", "--format", "jsonl")
+        end_outage()
+        counters = read_metrics(environment, 1)['counters']
+        check(code == 0, f"the scrape finished (exit code {code}, {wall:.2f} s)")
+        check(not counters.get('errors'), f"no works failed ({counters.get('errors', {})})")
+        print(f"  {MockAO3Handler.outage_requests} requests during the outage, the breaker opened {counters.get('circuit_trips', 0)} times")
+
+        print(f"Long outage after {options.after} works:")
+        start_outage(options.after, float('inf'))
+        wall, _, code = environment.run("--scrape", "--all", "--format", "jsonl")
+        outage_requests = MockAO3Handler.outage_requests
+        end_outage()
+        metrics = read_metrics(environment, 2)
+        check(code == 1, f"the scrape stopped (exit code {code}, {wall:.2f} s)")
+        check(outage_requests <= MAX_OUTAGE_REQUESTS, f"{outage_requests} requests during the outage (at most {MAX_OUTAGE_REQUESTS})")
+        check(metrics['counters'].get('circuit_trips') == OUTAGE_CONFIG['circuit_max_trips'], f"the breaker opened {metrics['counters'].get('circuit_trips')} times")
+
+        wall, _, code = environment.run("--scrape", "--resume", "--format", "jsonl")
+        check(code == 0, f"--resume finished after the outage (exit code {code}, {wall:.2f} s)")
+        with sqlite3.connect(environment.data_path / "fics.db") as connection:
+            pending = connection.execute("SELECT COUNT(*) FROM pending_fics WHERE run_id = 2").fetchone()[0]
+        check(pending == 0, f"no works were left unchecked ({pending} pending)")
+
+    server.shutdown()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
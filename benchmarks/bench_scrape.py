@@ -0,0 +1,67 @@
+# Benchmarks a whole scrape (ao3scraper --scrape --all) against the mock AO3 server, at several watchlist sizes.
+
+"""
+Usage: python benchmarks/bench_scrape.py [--sizes 100,1000,10000] [--processes N]
+
+For each size, a fresh fics.db is filled with that many works using --import, and then scraped twice:
+the first scrape fetches and parses every page, and the second one can skip the pages that haven't changed.
+Wall time and peak RSS are measured from outside the process. Requests per second and database write time come
+from the metrics file the scrape saves.
+"""
+
+import argparse
+import json
+import tempfile
+
+from environment import Environment
+from mock_server import start_server, server_url
+
+
+def benchmark_size(url, size, processes):
+    with Environment(url, {'processes': processes}) as environment, tempfile.TemporaryFile("w+") as urls:
+        for work_id in range(1, size + 1):
+            urls.write(f"https://archiveofourown.org/works/{work_id}\n")
+        urls.seek(0)
+        environment.run("--import", "-", stdin=urls)
+
+        results = []
+        for run_id, label in [(1, "cold"), (2, "warm")]:
+            wall, peak_rss, code = environment.run("--scrape", "--all", "--format", "jsonl")
+            if code != 0:
+                raise RuntimeError(f"ao3scraper exited with {code} while scraping {size} works")
+
+            metrics = json.loads((environment.data_path / "metrics" / f"run-{run_id}.json").read_text())
+            results.append({
+                'size': size,
+                'run': label,
+                'wall': wall,
+                'rps': metrics.get('requests_per_second', 0),
+                'peak_rss': peak_rss,
+                'db_write': metrics['timings'].get('db_write', {}).get('sum', 0),
+                'parse': metrics['timings'].get('parse', {}).get('sum', 0),
+                'errors': sum(metrics['counters'].get('errors', {}).values()),
+                'retries': sum(metrics['counters'].get('retries', {}).values()),
+            })
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="100,1000,10000", help="comma-separated numbers of works to scrape")
+    parser.add_argument("--processes", type=int, default=1, help="the processes setting to scrape with")
+    options = parser.parse_args()
+
+    server = start_server()
+    url = server_url(server)
+
+    print(f"{'works':>7} {'run':>5} {'wall (s)':>9} {'req/s':>8} {'peak RSS (MB)':>14} {'DB write (s)':>13} {'parse (s)':>10} {'errors':>7} {'retries':>8}")
+    for size in (int(size) for size in options.sizes.split(",")):
+        for result in benchmark_size(url, size, options.processes):
+            print(f"{result['size']:>7} {result['run']:>5} {result['wall']:>9.2f} {result['rps']:>8.1f} {result['peak_rss']:>14.1f} "
+                  f"{result['db_write']:>13.3f} {result['parse']:>10.2f} {result['errors']:>7} {result['retries']:>8}")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
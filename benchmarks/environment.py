@@ -0,0 +1,86 @@
+# Helpers shared by the benchmarks: a throwaway data and config location, and running ao3scraper inside it.
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import yaml
+
+REPO_PATH = Path(__file__).resolve().parent.parent
+PACKAGE_PATH = REPO_PATH / "ao3scraper"
+MAIN_PATH = PACKAGE_PATH / "__main__.py"
+
+# ao3scraper uses flat imports (import constants), so its directory has to be on the path.
+sys.path.insert(0, str(PACKAGE_PATH))
+
+# Limits high enough that the mock server, not the rate limiter, is what's being measured.
+BENCHMARK_CONFIG = {
+    'concurrency': 20,
+    'max_connections_per_host': 20,
+    'requests_per_second': 1000,
+    'min_requests_per_second': 100,
+    'max_requests_per_second': 1000,
+    'burst': 100,
+    'backoff_base': 0.01,
+    'backoff_max': 0.1,
+    'scrape_budget': 0,
+}
+
+
+class Environment:
+    """A temporary HOME for ao3scraper, with its own fics.db and config.yaml."""
+
+    def __init__(self, ao3_url=None, config=None):
+        self.directory = tempfile.TemporaryDirectory(prefix="ao3scraper-bench-")
+        home = self.directory.name
+
+        self.env = dict(os.environ, HOME=home, XDG_DATA_HOME=f"{home}/data", XDG_CONFIG_HOME=f"{home}/config")
+        if ao3_url is not None:
+            self.env['AO3SCRAPER_URL'] = ao3_url
+
+        # Ask ao3scraper where it will look, since that depends on the platform. This is done in another process,
+        # so that constants isn't imported here with the real HOME.
+        info = json.loads(subprocess.run(
+            [sys.executable, "-c", "import json, constants; print(json.dumps([constants.DATA_PATH, constants.CONFIG_PATH, constants.CONFIG_TEMPLATE]))"],
+            cwd=PACKAGE_PATH, env=self.env, capture_output=True, text=True, check=True,
+        ).stdout)
+        self.data_path, self.config_path, self.config_template = Path(info[0]), Path(info[1]), info[2]
+
+        self.write_config({**BENCHMARK_CONFIG, **(config or {})})
+
+    def activate(self):
+        """Points this process at the environment. It has to be called before any of ao3scraper's modules are imported."""
+
+        os.environ.update(self.env)
+
+    def write_config(self, overrides):
+        config = yaml.safe_load(self.config_template)
+        config.update(overrides)
+        self.config_path.mkdir(parents=True, exist_ok=True)
+        (self.config_path / "config.yaml").write_text(yaml.safe_dump(config, sort_keys=False))
+
+    def run(self, *args, stdin=None):
+        """Runs ao3scraper with args, and returns its wall time (s), peak RSS (MB) and exit code. Its output is discarded."""
+
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, str(MAIN_PATH), *args], cwd=REPO_PATH, env=self.env,
+                                   stdin=stdin or subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        _, status, usage = os.wait4(process.pid, 0)
+        wall = time.perf_counter() - start
+
+        # ru_maxrss is in KB on Linux and in bytes on macOS.
+        peak_rss = usage.ru_maxrss / 1024 if sys.platform != "darwin" else usage.ru_maxrss / (1024 * 1024)
+        return wall, peak_rss, os.waitstatus_to_exitcode(status)
+
+    def close(self):
+        self.directory.cleanup()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
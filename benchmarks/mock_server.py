@@ -0,0 +1,167 @@
+# A local HTTP server that stands in for AO3, serving the pages in fixtures/ so scrapes can be benchmarked offline.
+
+"""
+What a work ID gets depends on its last two digits:
+- 00-79: a multi-chapter work (even IDs) or a oneshot (odd IDs)
+- 80-89: the same, but only after SLOW_DELAY seconds
+- 90-94: the login page AO3 shows for restricted works
+- 95-97: 404 Not Found
+- 98: 503 the first time it is requested, then the work
+- 99: 429 with a Retry-After header the first time it is requested, then the work
+With view_full_work=true, multi-chapter works get every chapter's text instead of only the first one's.
+Every page gets a new CSRF token, as AO3's do.
+During an outage (see start_outage), every work page gets 503 Service Unavailable instead.
+
+Run it on its own with: python benchmarks/mock_server.py [port]
+"""
+
+import re
+import secrets
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+FIXTURES_PATH = Path(__file__).parent / "fixtures"
+SLOW_DELAY = 0.25
+
+WORK_PATH = re.compile(r"^/works/(\d+)")
+
+# The first chapter of work.html, which full_work copies for the others
+FIRST_CHAPTER = re.compile(rb'    <div class="chapter" id="chapter-1">.*?\n    </div>\n', re.DOTALL)
+CHAPTERS = 3
+
+
+def load_fixture(name):
+    return (FIXTURES_PATH / name).read_bytes()
+
+
+def full_work(page):
+    """Returns the page AO3 serves for a work with view_full_work=true, where every chapter follows the first."""
+
+    first = FIRST_CHAPTER.search(page).group(0)
+    chapters = [first.replace(b'id="chapter-1"', f'id="chapter-{number}"'.encode())
+                     .replace(b"/chapters/11", f"/chapters/{10 + number}".encode())
+                     .replace(b">Chapter 1<", f">Chapter {number}<".encode())
+                for number in range(2, CHAPTERS + 1)]
+    return page.replace(first, first + b"".join(chapters))
+
+
+class MockAO3Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    pages = {name: load_fixture(f"{name}.html") for name in ["work", "oneshot", "restricted", "not_found"]}
+    pages["full_work"] = full_work(pages["work"])
+
+    # IDs that have already been throttled once
+    throttled = set()
+    throttled_lock = threading.Lock()
+
+    # Work pages requested so far, and how many of them were requested during an outage
+    requests = 0
+    outage_requests = 0
+
+    # An outage starts once `requests` reaches outage_start, and lasts outage_length seconds from then.
+    outage_start = None
+    outage_length = 0
+    outage_until = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        match = WORK_PATH.match(self.path)
+
+        if self.path == "/":
+            self.send_page(200, b"<html><body>Archive of Our Own</body></html>")
+        elif match is None:
+            self.send_page(404, self.pages["not_found"])
+        else:
+            self.send_work(int(match.group(1)), "view_full_work=true" in self.path)
+
+    def send_work(self, work_id, full=False):
+        kind = work_id % 100
+
+        if self.in_outage():
+            return self.send_page(503, b"<html><body>Service Unavailable</body></html>")
+
+        if kind in (98, 99):
+            with self.throttled_lock:
+                first_time = work_id not in self.throttled
+                self.throttled.add(work_id)
+            if first_time and kind == 98:
+                return self.send_page(503, b"<html><body>Service Unavailable</body></html>")
+            if first_time and kind == 99:
+                return self.send_page(429, b"<html><body>Retry later</body></html>", {"Retry-After": "0"})
+
+        if 80 <= kind <= 89:
+            time.sleep(SLOW_DELAY)
+
+        if 90 <= kind <= 94:
+            page = self.pages["restricted"]
+        elif 95 <= kind <= 97:
+            return self.send_page(404, self.pages["not_found"])
+        elif work_id % 2 == 0:
+            page = self.pages["full_work" if full else "work"]
+        else:
+            page = self.pages["oneshot"]
+
+        page = page.replace(b"WORK_ID", str(work_id).encode()).replace(b"CSRF_TOKEN", secrets.token_hex(16).encode())
+        self.send_page(200, page)
+
+    @classmethod
+    def in_outage(cls):
+        with cls.throttled_lock:
+            cls.requests += 1
+            if cls.outage_start is not None and cls.requests >= cls.outage_start:
+                cls.outage_until = time.monotonic() + cls.outage_length
+                cls.outage_start = None
+
+            if time.monotonic() < cls.outage_until:
+                cls.outage_requests += 1
+                return True
+            return False
+
+    def send_page(self, status, body, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_server(port=0):
+    """Starts the server in a background thread and returns it. Its URL is server_url(server)."""
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), MockAO3Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_outage(after_requests, seconds):
+    """Makes the server answer every work page with 503 for seconds, starting after after_requests more work pages."""
+
+    with MockAO3Handler.throttled_lock:
+        MockAO3Handler.outage_start = MockAO3Handler.requests + after_requests
+        MockAO3Handler.outage_length = seconds
+        MockAO3Handler.outage_requests = 0
+
+
+def end_outage():
+    with MockAO3Handler.throttled_lock:
+        MockAO3Handler.outage_start = None
+        MockAO3Handler.outage_until = 0
+
+
+def server_url(server):
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    print(f"Serving fixtures on http://127.0.0.1:{port}")
+    ThreadingHTTPServer(("127.0.0.1", port), MockAO3Handler).serve_forever()